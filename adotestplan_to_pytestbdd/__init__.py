@@ -1,9 +1,28 @@
 from importlib.metadata import version
 
 from adotestplan_to_pytestbdd.ado_test_plan import AzureDevOpsTestPlan as ADOTestPlan
-from adotestplan_to_pytestbdd.ado_test_plan import BDDTestPlan, Feature, Scenario, Step
+from adotestplan_to_pytestbdd.ado_test_plan import (
+    BDDTestPlan,
+    Feature,
+    Scenario,
+    SharedStepExpansion,
+    Step,
+)
+from adotestplan_to_pytestbdd.plan_batch import (
+    AzureDevOpsTestPlanBatch as ADOTestPlanBatch,
+)
+from adotestplan_to_pytestbdd.work_item_cache import WorkItemCache
 
 __version__ = version("adotestplan_to_pytestbdd")
 
 
-__all__ = ["ADOTestPlan", "Step", "BDDTestPlan", "Feature", "Scenario"]
+__all__ = [
+    "ADOTestPlan",
+    "ADOTestPlanBatch",
+    "Step",
+    "BDDTestPlan",
+    "Feature",
+    "Scenario",
+    "SharedStepExpansion",
+    "WorkItemCache",
+]
@@ -1,23 +1,30 @@
+import asyncio
+import gzip
+import hashlib
 import json
 import logging
 import os
 import re
 import shutil
 import subprocess
-import xml.etree.ElementTree as ET
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from io import StringIO
-from itertools import product
 from pathlib import Path
-from typing import List, TypedDict
+from typing import List, TypedDict, Union
 
 import pydot
 from azure.devops.connection import Connection
+from azure.devops.exceptions import AzureDevOpsServiceError
 from azure.devops.v7_0.test.models import SuiteTestCase
 from azure.devops.v7_0.test.test_client import TestClient
 from azure.devops.v7_0.test_plan.models import TestPlan, TestSuite
 from azure.devops.v7_0.test_plan.test_plan_client import TestPlanClient
-from azure.devops.v7_0.work_item_tracking import WorkItemTrackingClient
+from azure.devops.v7_0.work_item_tracking import Wiql, WorkItemTrackingClient
 from azure.devops.v7_0.work_item_tracking.models import WorkItem
 from azure.devops.v7_0.work_item_tracking_process import WorkItemTrackingProcessClient
 from bs4 import BeautifulSoup
@@ -33,20 +40,105 @@ from adotestplan_to_pytestbdd.exceptions import (
     MissingFixturesError,
     NoTestSuiteError,
     OrderOfOperationsError,
+    SharedStepCycleError,
 )
+from adotestplan_to_pytestbdd.feature_renderer import (
+    EXAMPLE_ROWS_OVERFLOWS,
+    EXAMPLES_MODES,
+    FeatureRenderer,
+    find_placeholders,
+    is_examples_mode,
+    render_in_worker,
+    start_render_worker,
+)
+from adotestplan_to_pytestbdd.request_scheduler import RequestScheduler
+from adotestplan_to_pytestbdd.snapshot import Snapshot
+from adotestplan_to_pytestbdd.step_text import extract_step_text
+from adotestplan_to_pytestbdd.work_item_cache import WorkItemCache
+from adotestplan_to_pytestbdd.work_item_record import WorkItemRecord
+
+# the most work item IDs ADO will accept in a single get_work_items request
+WORK_ITEM_BATCH_SIZE = 200
+
+# the work item fields this package reads. Fetching only these, instead of
+# expand="All", keeps relations, links and custom fields out of the responses
+WORK_ITEM_FIELDS = [
+    "System.Title",
+    "System.State",
+    "System.Tags",
+    "Microsoft.VSTS.TCM.Steps",
+    "Microsoft.VSTS.TCM.Parameters",
+    "Microsoft.VSTS.TCM.LocalDataSource",
+]
+
+# changes are looked for from this long before the watermark, in case the
+# server's clock (which stamps System.ChangedDate) is behind this machine's
+WATERMARK_SAFETY_MARGIN = timedelta(minutes=5)
+
+# the error ADO answers a WIQL query with when it would return more than
+# 20,000 work items, which is more than an incremental populate() can use
+WIQL_SIZE_LIMIT_ERROR = "VS402337"
+
+# what pytest-bdd's generation API raises, besides a FeatureError, when it
+# doesn't get along with the gherkin parser installed alongside it (on 9.x,
+# a KeyError), in which case `pytest-bdd generate` is run instead
+PYTEST_BDD_API_ERRORS = (LookupError, AttributeError, TypeError)
+
+# a big plan holds a lot of these model objects, and slots make each one much
+# smaller. dataclasses only support slots from python 3.10 onwards though
+MODEL_OPTIONS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**MODEL_OPTIONS)
+class SharedStepExpansion:
+    """A shared step's expanded contents. There is one per shared step,
+    which every Step that references the shared step links to."""
+
+    id: int = 0
+    contents: Union[str, List[str]] = ""
+    # every shared step nested in this one, at any depth
+    nested_ids: List[int] = field(default_factory=list)
+    _text: str = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def text(self):
+        """the contents as a step's text, only joined the first time it's read"""
+        if self._text is None:
+            contents = self.contents
+            self._text = contents if isinstance(contents, str) else "\n".join(contents)
+        return self._text
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class Step:
     id: int = 0
-    text: str = ""
     revision: int = 0
+    # once linked, the text is read from the shared step this references
+    shared_step: SharedStepExpansion = None
+    _text: str = ""
+
+    def __init__(self, id=0, text="", revision=0, shared_step=None):
+        self.id = id
+        self._text = text
+        self.revision = revision
+        self.shared_step = shared_step
+
+    @property
+    def text(self):
+        if self.shared_step is not None:
+            return self.shared_step.text
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self.shared_step = None
 
     def __str__(self):
         return self.text
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class Background:
     name: str = ""
     revision: int = 0
@@ -58,7 +150,7 @@ class Parameter(TypedDict):
     value: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class Scenario:
     id: int = 0
     revision: int = 0
@@ -69,12 +161,16 @@ class Scenario:
     is_background: bool = False
     ado_work_item: WorkItem = None
     non_shared_parameters: Parameter = field(default_factory=dict)
+    # the shared parameter sets the scenario draws values from, in order
+    shared_parameter_ids: List[int] = field(default_factory=list)
+    # an outline's <placeholders>, in order, found once its steps are linked
+    placeholders: List[str] = None
 
     def __str__(self):
         return self.name
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class Feature:
     id: int = 0
     name: str = ""
@@ -86,19 +182,87 @@ class Feature:
         return self.name
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class SharedParameters:  # don't use typed dict here because we only want 1 possible key
     id: int = 0  # this is the key
     revision: int = 0
     parameters: Parameter = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(**MODEL_OPTIONS)
 class BDDTestPlan:
     features: List[Feature] = field(default_factory=list)
     shared_parameters: SharedParameters = field(default_factory=dict)
 
 
+# the version of the file save_plan() writes, bumped whenever its layout changes
+PLAN_FORMAT_VERSION = 2
+
+
+def _encode_steps(steps: List[Step], shared_steps: dict):
+    """steps are by far the most numerous, so each is a short [id, text, revision]
+    list. A linked step's text is left as None, and the shared step it links to
+    is only saved once, in shared_steps"""
+    encoded = []
+    for step in steps:
+        if step.shared_step is not None:
+            shared_steps[str(step.shared_step.id)] = step.shared_step
+            encoded.append([step.id, None, step.revision, step.shared_step.id])
+        else:
+            encoded.append([step.id, step.text, step.revision])
+    return encoded
+
+
+def _decode_steps(encoded: list, shared_steps: dict):
+    steps = []
+    for id, text, revision, *shared_step_id in encoded:
+        step = Step(id=id, text="" if text is None else text, revision=revision)
+        if shared_step_id:
+            step.shared_step = shared_steps[str(shared_step_id[0])]
+        steps.append(step)
+    return steps
+
+
+def _encode_scenario(scenario, shared_steps: dict):
+    encoded = {
+        "name": scenario.name,
+        "revision": scenario.revision,
+        "steps": _encode_steps(scenario.steps, shared_steps),
+    }
+    if isinstance(scenario, Scenario):
+        encoded.update(
+            id=scenario.id,
+            tags=scenario.tags,
+            is_outline=scenario.is_outline,
+            is_background=scenario.is_background,
+            non_shared_parameters=scenario.non_shared_parameters,
+            shared_parameter_ids=scenario.shared_parameter_ids,
+            placeholders=scenario.placeholders,
+        )
+    return encoded
+
+
+def _decode_scenario(encoded: dict, shared_steps: dict):
+    steps = _decode_steps(encoded["steps"], shared_steps)
+    if "id" not in encoded:
+        # a Background, rather than a background scenario
+        return Background(
+            name=encoded["name"], revision=encoded["revision"], steps=steps
+        )
+    return Scenario(
+        id=encoded["id"],
+        revision=encoded["revision"],
+        name=encoded["name"],
+        steps=steps,
+        tags=encoded["tags"],
+        is_outline=encoded["is_outline"],
+        is_background=encoded["is_background"],
+        non_shared_parameters=encoded["non_shared_parameters"],
+        shared_parameter_ids=encoded.get("shared_parameter_ids", []),
+        placeholders=encoded.get("placeholders"),
+    )
+
+
 class AzureDevOpsTestPlan:
     """Test Plan Class to import test suites from
     ADO and parse to BDD feature files"""
@@ -116,6 +280,18 @@ class AzureDevOpsTestPlan:
         out_dir: str = "gen",
         ignore_tags_list: list = None,
         ignore_states: list = None,
+        max_workers: int = 1,
+        cache_dir: str = None,
+        watermark_file: str = None,
+        extra_fields: list = None,
+        snapshot_file: str = None,
+        snapshot_mode: str = None,
+        retain_work_items: bool = True,
+        incremental_write: bool = False,
+        render_processes: int = 1,
+        examples_mode: str = "product",
+        max_example_rows: int = None,
+        example_rows_overflow: str = "warn",
     ):
         timebudget.set_quiet()
         self.profile = profile
@@ -139,37 +315,396 @@ class AzureDevOpsTestPlan:
             self._ignore_states = []
         else:
             self._ignore_states = ignore_states
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self._watermark_file = watermark_file
+        if extra_fields is None:
+            self._extra_fields = []
+        else:
+            self._extra_fields = extra_fields
+        self.last_synced = None
+        self._snapshot_file = snapshot_file
+        self.snapshot_mode = snapshot_mode
+        self._retain_work_items = retain_work_items
+        self._incremental_write = incremental_write
+        self.render_processes = render_processes
+        self.examples_mode = examples_mode
+        self.max_example_rows = max_example_rows
+        self.example_rows_overflow = example_rows_overflow
         # pre-populate some fields
         self.bdd_tp = BDDTestPlan()
         self._azure_test_suites = []
         self._shared_steps = {}
+        self._shared_step_items = {}
+        self._shared_step_expansions = {}
+        # the values of each shared parameter set fetched, by ID
+        self._shared_param_values = {}
+        # guards the shared step and shared parameter caches, which
+        # may be shared with other plans (see _share_ado_session)
+        self._shared_item_lock = threading.RLock()
+        # a Future for each shared work item being fetched right now
+        self._shared_item_fetches = {}
+        self._session_source = None
+        self._suite_test_case_ids = {}
 
         self.valid_starters = ["given", "when", "then", "but", "and"]
 
-    def populate(self):
-        self._open_ado_connection()
-        self._get_ado_clients()
-        self._get_azure_test_case_valid_states()
-        self.get_azure_test_plan()
-        self._get_azure_test_suites()
-        # at this point, we have read in most of the azure items.
-        # now, we start converting them to BDD
-        self._populate_bdd_features_from_azure_test_suites()
+    def populate(self, since: datetime = None):
+        """Reads the test plan from ADO into self.bdd_tp.
+
+        If self.bdd_tp already holds the plan, only what changed in ADO after
+        since is re-fetched, and only the features it affects are rebuilt.
+        since defaults to the end of the last successful populate(), which is
+        persisted in watermark_file if one is set."""
+        started = datetime.now(timezone.utc)
+        if since is None:
+            since = self._read_watermark()
+        if self._session_source is None:
+            self._open_ado_connection()
+            self._get_ado_clients()
+        incremental = since is not None and bool(self.bdd_tp.features)
+        if incremental and not self._populate_changes_since(since):
+            logging.warning(
+                f"Too much changed since {since} to update plan "
+                + f"{self.plan_id} incrementally, reading all of it again"
+            )
+            self._forget_populated_plan()
+            incremental = False
+        if not incremental:
+            if self._session_source is None:
+                self._get_azure_test_case_valid_states()
+            self.get_azure_test_plan()
+            self._get_azure_test_suites()
+            # at this point, we have read in most of the azure items.
+            # now, we start converting them to BDD
+            self._populate_bdd_features_from_azure_test_suites()
+
+            # there is a bit more fetching from azure at this point
+            # since we now know which shared steps are used
+            self._get_azure_shared_steps()
+
+            self._link_shared_steps_back_to_bdd_scenarios()
+
+            # the final bit of fetching will get all shared parameter values
+            self._get_azure_shared_params()
+        self._finish_populate(started)
+        # At the end of the populate function, no files have been written
+        # but the self.bdd_tp dictionary should be complete and READY
+        # to write to disk.  We don't do that here though in case
+        # further validation is desired.
+
+    async def apopulate(self, max_concurrency: int = None):
+        """The asyncio flavor of populate(). It produces the same self.bdd_tp, but
+        runs the fetches as a graph of stages rather than one after another:
+        the valid states are fetched alongside the plan and its suites, and
+        each suite's shared steps and shared parameters are fetched as soon as
+        that suite has been parsed, while other suites are still in flight.
+
+        At most max_concurrency (default: max_workers) ADO requests are
+        outstanding at once."""
+        started = datetime.now(timezone.utc)
+        max_concurrency = max_concurrency or self.max_workers
+        limit = asyncio.Semaphore(max_concurrency)
+
+        async def run(fn, *args, **kwargs):
+            # the azure-devops clients are blocking, so every request
+            # gets its own thread, gated by the concurrency limit
+            async with limit:
+                return await asyncio.to_thread(fn, *args, **kwargs)
+
+        async def get_plan_and_suites():
+            await run(self.get_azure_test_plan)
+            await run(self._get_azure_test_suites)
+
+        async def get_shared_params(ids):
+            shared_param_values = await run(self._fetch_shared_param_values, ids)
+            self._fill_shared_parameters(shared_param_values)
+
+        if self._session_source is None:
+            self._open_ado_connection()
+            self._get_ado_clients(max_concurrency)
+            await asyncio.gather(
+                run(self._get_azure_test_case_valid_states), get_plan_and_suites()
+            )
+        else:
+            await get_plan_and_suites()
+
+        test_suites = self._get_unpopulated_azure_test_suites(self.bdd_tp.features)
+        fetches = [
+            asyncio.ensure_future(run(self._get_azure_work_items_for_test_suite, suite))
+            for suite in test_suites
+        ]
+        follow_ups = []
+        requested_shared_step_ids = set()
+        requested_shared_param_ids = set()
+        try:
+            # suites are parsed in order (so the result matches populate()),
+            # but the fetches behind them are all already running
+            for test_suite, fetch in zip(test_suites, fetches):
+                feature = self._build_feature_from_azure_test_suite(
+                    test_suite, await fetch
+                )
+                self.bdd_tp.features.append(feature)
+
+                shared_step_ids = [
+                    id
+                    for id in self._collect_shared_step_ids([feature])
+                    if id not in requested_shared_step_ids
+                ]
+                if shared_step_ids:
+                    requested_shared_step_ids.update(shared_step_ids)
+                    follow_ups.append(
+                        asyncio.ensure_future(
+                            run(self._get_shared_steps, shared_step_ids)
+                        )
+                    )
 
-        # there is a bit more fetching from azure at this point
-        # since we now know which shared steps are used
-        self._get_azure_shared_steps()
+                shared_param_ids = [
+                    id
+                    for id in self.bdd_tp.shared_parameters
+                    if id not in requested_shared_param_ids
+                ]
+                if shared_param_ids:
+                    requested_shared_param_ids.update(shared_param_ids)
+                    follow_ups.append(
+                        asyncio.ensure_future(get_shared_params(shared_param_ids))
+                    )
+            await asyncio.gather(*follow_ups)
+        finally:
+            for task in fetches + follow_ups:
+                task.cancel()
 
+        if not requested_shared_step_ids:
+            logging.warning(f"No shared step IDs for plan {self.plan_id}")
         self._link_shared_steps_back_to_bdd_scenarios()
+        self._finish_populate(started)
+
+    def iter_features(self):
+        """Reads the test plan from ADO like populate(), but yields each Feature as
+        soon as it is complete, instead of once the whole plan has been read.
+        A yielded feature already has its shared steps linked, and the values
+        of its shared parameters are in self.bdd_tp.shared_parameters.
+
+        The features are not kept in self.bdd_tp.features, so only the ones
+        in flight are held in memory. Suites are still fetched up to
+        max_workers at a time, a little ahead of the feature being yielded."""
+        started = datetime.now(timezone.utc)
+        if self._session_source is None:
+            self._open_ado_connection()
+            self._get_ado_clients()
+            self._get_azure_test_case_valid_states()
+        self.get_azure_test_plan()
+        self._azure_test_suites = []
+        self._get_azure_test_suites()
 
-        # the final bit of fetching will get all shared parameter values
-        self._get_azure_shared_params()
+        test_suites = self._get_unpopulated_azure_test_suites([])
+        suite_work_items = self._map_concurrently(
+            self._get_azure_work_items_for_test_suite, test_suites
+        )
+        requested_shared_param_ids = set()
+        for test_suite, scenario_work_items in zip(test_suites, suite_work_items):
+            feature = self._build_feature_from_azure_test_suite(
+                test_suite, scenario_work_items
+            )
+            shared_step_ids = self._collect_shared_step_ids([feature])
+            if shared_step_ids:
+                self._get_shared_steps(shared_step_ids)
+                self._link_shared_steps_back_to_bdd_scenarios([feature])
+
+            shared_param_ids = [
+                id
+                for id in self.bdd_tp.shared_parameters
+                if id not in requested_shared_param_ids
+            ]
+            if shared_param_ids:
+                requested_shared_param_ids.update(shared_param_ids)
+                self._fill_shared_parameters(
+                    self._fetch_shared_param_values(shared_param_ids)
+                )
+            yield feature
+        self._finish_populate(started)
+
+    def _finish_populate(self, started: datetime):
+        """bookkeeping after a successful populate(), of any flavor"""
+        self._write_watermark(started)
+        if self.work_item_cache is not None:
+            self.work_item_cache.prune()
+        if self.snapshot_mode == "record":
+            self.snapshot.save(self.snapshot_file)
         if self._profile:
             timebudget.report(reset=True)
-        # At the end of the populate function, no files have been written
-        # but the self.bdd_tp dictionary should be complete and READY
-        # to write to disk.  We don't do that here though in case
-        # further validation is desired.
+            self.scheduler.report()
+
+    @timebudget
+    def _populate_changes_since(self, since: datetime):
+        """This subroutine brings an already populated self.bdd_tp up to date.
+        A single WIQL query finds the test items changed since the watermark.
+        Then only the features whose suite or test cases changed are re-fetched,
+        only the features using a changed shared step are re-linked, and only
+        changed (or newly referenced) shared parameters are re-fetched.
+        Everything else is left exactly as it was.
+
+        It returns False, without changing anything, if too many work items
+        have changed for ADO to list them."""
+        changed_ids = self._query_changed_work_item_ids(since)
+        if changed_ids is None:
+            return False
+        changed_ids = set(changed_ids)
+        logging.info(f"{len(changed_ids)} work items changed since {since}")
+
+        self.get_azure_test_plan()
+        self._azure_test_suites = []
+        self._get_azure_test_suites()
+        test_suites = self._get_unpopulated_azure_test_suites([])
+
+        existing_features = {feature.id: feature for feature in self.bdd_tp.features}
+        stale_suites = [
+            test_suite
+            for test_suite in test_suites
+            if self._is_feature_stale(
+                existing_features.get(test_suite.id), test_suite, changed_ids
+            )
+        ]
+        suite_work_items = self._map_concurrently(
+            self._get_azure_work_items_for_test_suite, stale_suites
+        )
+        rebuilt_features = {}
+        for test_suite, scenario_work_items in zip(stale_suites, suite_work_items):
+            rebuilt_features[test_suite.id] = self._build_feature_from_azure_test_suite(
+                test_suite, scenario_work_items
+            )
+        # keep suite order, dropping the features of suites that are gone
+        self.bdd_tp.features = [
+            rebuilt_features.get(test_suite.id, existing_features.get(test_suite.id))
+            for test_suite in test_suites
+        ]
+
+        stale_shared_step_ids = self._forget_shared_steps(changed_ids)
+        features_to_link = [
+            feature
+            for feature in self.bdd_tp.features
+            if feature.id in rebuilt_features
+            or stale_shared_step_ids.intersection(
+                self._collect_shared_step_ids([feature])
+            )
+        ]
+        self._get_shared_steps(self._collect_shared_step_ids(features_to_link))
+        self._link_shared_steps_back_to_bdd_scenarios(features_to_link)
+
+        shared_param_ids = []
+        for id, shared_parameter in self.bdd_tp.shared_parameters.items():
+            # no parameters yet means a newly referenced set
+            if id in changed_ids or not shared_parameter.parameters:
+                shared_param_ids.append(id)
+        with self._shared_item_lock:
+            for id in changed_ids:
+                self._shared_param_values.pop(id, None)
+        if shared_param_ids:
+            self._fill_shared_parameters(
+                self._fetch_shared_param_values(shared_param_ids)
+            )
+        return True
+
+    def _query_changed_work_item_ids(self, since: datetime):
+        """This subroutine asks ADO for the IDs of every test related work item
+        in the project that has changed since the given time, less
+        WATERMARK_SAFETY_MARGIN. It returns None if there are more of them
+        than a WIQL query is allowed to return."""
+        since_utc = (since - WATERMARK_SAFETY_MARGIN).astimezone(timezone.utc)
+        # a quote in a WIQL string is escaped by doubling it
+        project = self.project.replace("'", "''")
+        wiql = Wiql(
+            query="SELECT [System.Id] FROM WorkItems"
+            + f" WHERE [System.TeamProject] = '{project}'"
+            + " AND [System.WorkItemType] IN"
+            + " ('Test Suite', 'Test Case', 'Shared Steps', 'Shared Parameter')"
+            + f" AND [System.ChangedDate] > '{since_utc:%Y-%m-%dT%H:%M:%SZ}'"
+        )
+        try:
+            result = self.witc.query_by_wiql(wiql, time_precision=True)
+        except AzureDevOpsServiceError as error:
+            if WIQL_SIZE_LIMIT_ERROR in str(error):
+                return None
+            raise
+        return [work_item.id for work_item in result.work_items]
+
+    def _forget_populated_plan(self):
+        """This subroutine drops everything populate() has read for this plan, so
+        that the next one reads all of it again, along with the shared steps
+        and shared parameters it uses. Those may be cached for other plans
+        too (see _share_ado_session), which just fetch them again as well."""
+        shared_step_ids = set(self._collect_shared_step_ids(self.bdd_tp.features))
+        for expansion in self._collect_shared_step_expansions(
+            self.bdd_tp.features
+        ).values():
+            shared_step_ids.update(expansion.nested_ids)
+        self._forget_shared_steps(shared_step_ids)
+        with self._shared_item_lock:
+            for id in self.bdd_tp.shared_parameters:
+                self._shared_param_values.pop(id, None)
+        self.bdd_tp = BDDTestPlan()
+        self._azure_test_suites = []
+        self._suite_test_case_ids = {}
+
+    def _is_feature_stale(self, feature: Feature, test_suite: TestSuite, changed_ids):
+        if feature is None:
+            return True  # a suite new to the plan
+        if test_suite.id in changed_ids or feature.revision != test_suite.revision:
+            return True
+        # the suite's test cases, including any skipped for their tags or state
+        test_case_ids = self._suite_test_case_ids.get(test_suite.id)
+        if test_case_ids is None:
+            test_case_ids = [scenario.id for scenario in feature.scenarios]
+            if feature.background is not None:
+                test_case_ids.append(feature.background.id)
+        return not changed_ids.isdisjoint(test_case_ids)
+
+    def _forget_shared_steps(self, changed_ids):
+        """This subroutine drops every cached shared step that changed. Every shared
+        step nesting one of those keeps its work item, but its expansion is
+        stale too and is dropped. It returns the IDs of all stale expansions.
+
+        The shared steps linked in a plan from load_plan() were never fetched
+        here, so those are found from the expansions the plan's steps link to."""
+        with self._shared_item_lock:
+            stale_ids = {id for id in self._shared_step_items if id in changed_ids}
+            for id, expansion in self._collect_shared_step_expansions(
+                self.bdd_tp.features
+            ).items():
+                if id in changed_ids or not changed_ids.isdisjoint(
+                    expansion.nested_ids
+                ):
+                    stale_ids.add(id)
+            while True:
+                stale_parent_ids = {
+                    id
+                    for id, shared_step_item in self._shared_step_items.items()
+                    if id not in stale_ids
+                    and not stale_ids.isdisjoint(
+                        self._get_shared_step_refs(shared_step_item)
+                    )
+                }
+                if not stale_parent_ids:
+                    break
+                stale_ids |= stale_parent_ids
+            for id in stale_ids:
+                if id in changed_ids:
+                    self._shared_step_items.pop(id, None)
+                self._shared_steps.pop(id, None)
+                self._shared_step_expansions.pop(id, None)
+        return stale_ids
+
+    def _read_watermark(self):
+        if self.watermark_file is not None and os.path.exists(self.watermark_file):
+            with open(self.watermark_file, "r") as watermark:
+                return datetime.fromisoformat(watermark.read().strip())
+        return self.last_synced
+
+    def _write_watermark(self, synced: datetime):
+        self.last_synced = synced
+        if self.watermark_file is not None:
+            with open(self.watermark_file, "w") as watermark:
+                watermark.write(synced.isoformat())
 
     @property
     def plan_id(self):
@@ -245,135 +780,261 @@ class AzureDevOpsTestPlan:
     def ignore_states(self, value):
         self._ignore_states = value
 
-    @timebudget
-    def _build_examples_outline(self, nonshared_parameters, examples_to_match):
-        """This subroutine will loop through all of the ADO shared parameters in a given
-        test scenario, and generate a gherkin formatted examples table from them to
-        be placed in the features file."""
-        examples_str = ""
-        examples_version_str = ""  # unused for non-shared parameters
-        # first, merge shared and non-shared
-        all_parameters = {}
-        for shared_parameter_id in self.bdd_tp.shared_parameters:
-            shared_parameter = self.bdd_tp.shared_parameters[shared_parameter_id]
-            examples_version_str += f"\t\t\t# Shared Parameters {shared_parameter_id}: Revision {shared_parameter.revision}\n"  # noqa: E501
-            # these operations require python>=3.9
-            all_parameters |= shared_parameter.parameters
-        all_parameters |= nonshared_parameters  # these operations require python>=3.9
-        if all(example in all_parameters for example in examples_to_match):
-            # Corrected header formatting
-            examples_str += (
-                "\t\t\t| "
-                + " | ".join(example.center(30) for example in examples_to_match)
-                + " |\n"
-            )
-            # Iterate through each parameter set separately
-            parameter_sets = []
-            for example in examples_to_match:
-                temp = []
-                parameter = all_parameters[example]
-                if isinstance(parameter, list):
-                    for param_val in parameter:
-                        temp.append(param_val)
-                else:
-                    temp.append(parameter)
-                parameter_sets.append(temp)
-            combinations = product(*parameter_sets)
-
-            for combo in combinations:
-                examples_str += (
-                    "\t\t\t| "
-                    + " | ".join([str(value).center(30) for value in combo])
-                    + " |\n"
-                )
-        else:
-            missing_fields = [
-                example
-                for example in examples_to_match
-                if example not in all_parameters
-            ]
-            if missing_fields:
-                logging.warning(f"Outline Params not found:{', '.join(missing_fields)}")
+    @property
+    def max_workers(self):
+        return self._max_workers
 
-        examples_str += "\n"
+    @max_workers.setter
+    def max_workers(self, value):
+        if value < 1:
+            raise ValueError(f"max_workers must be at least 1, not {value}")
+        self._max_workers = value
 
-        return examples_str, examples_version_str
+    @property
+    def render_processes(self):
+        return self._render_processes
+
+    @render_processes.setter
+    def render_processes(self, value):
+        """how many worker processes write_feature_files() renders features in.
+        1 renders them in this process instead. A worker sends each feature back
+        whole, so only rendering in this process streams big Examples tables"""
+        if value < 1:
+            raise ValueError(f"render_processes must be at least 1, not {value}")
+        self._render_processes = value
 
-    @timebudget
-    def _write_scenario(self, scenario: Scenario, feature: Feature, file):
-        logging.info(
-            f"Writing scenario: {scenario.name}_{scenario.id} Revision: {scenario.revision}"
-        )  # noqa: E501
-        file.write(f"\t@{scenario.id} ")
-        for tag in scenario.tags:
-            if tag not in self._ignore_tags_list:
-                file.write(f"@{tag} ")
-
-        file.write("\n")
-        if scenario.is_outline:
-            file.write(
-                f"\tScenario Outline: {scenario.name}_{scenario.id}_Revision_{scenario.revision}\n"
-            )  # noqa: E501
-        else:
-            file.write(
-                f"\tScenario: {scenario.name}_{scenario.id}_Revision_{scenario.revision}\n"
-            )  # noqa: E501
+    @property
+    def examples_mode(self):
+        return self._examples_mode
+
+    @examples_mode.setter
+    def examples_mode(self, value):
+        """how an outline's parameter values become Examples rows. "product" writes
+        every combination of them. "zip" writes each data row of the parameter
+        table as one row, as ADO does, with any value it lacks left blank.
+        "pairwise" writes only enough rows for every pair of values of any two
+        parameters to be in one of them, and
+        "<t>way", e.g. "3way", for every combination of any t parameters.
+        A scenario tagged examples_<mode> uses that mode instead."""
+        if not is_examples_mode(value):
+            raise ValueError(
+                f'examples_mode must be one of {EXAMPLES_MODES} or "<t>way"'
+            )
+        self._examples_mode = value
 
-        examples_to_match = []
-        for step in scenario.steps:
-            if scenario.is_outline:
-                # note that here it still doesn't have the azuredevops "@" prefix
-                # because that should have been removed by now.
-                [
-                    examples_to_match.append(x)
-                    for x in re.findall(r"<(.*?)>", step.text)
-                    if x not in examples_to_match
-                ]
-            file.write(f"\t\t{step.text}\n")
-        file.write("\n")
+    @property
+    def max_example_rows(self):
+        return self._max_example_rows
 
-        if scenario.is_outline:
-            examples_str, examples_version_str = self._build_examples_outline(
-                scenario.non_shared_parameters, examples_to_match
-            )
-            file.write("\t\tExamples:\n")
-            file.write(examples_str)
-            file.write(examples_version_str)
-        return True
+    @max_example_rows.setter
+    def max_example_rows(self, value):
+        """the most Examples rows an outline may have, or None for no limit"""
+        if value is not None and value < 1:
+            raise ValueError(f"max_example_rows must be at least 1, not {value}")
+        self._max_example_rows = value
 
-    @timebudget
-    def _write_feature_file(self, feature: Feature):
-        if not len(feature.scenarios):
-            logging.warning(
-                f"Feature {feature} has no scenarios in plan {self.plan_id}"
+    @property
+    def example_rows_overflow(self):
+        return self._example_rows_overflow
+
+    @example_rows_overflow.setter
+    def example_rows_overflow(self, value):
+        """what happens to an outline with more than max_example_rows rows.
+        "warn" writes only the first max_example_rows of them, with a warning.
+        "error" raises ExamplesTooLargeError instead."""
+        if value not in EXAMPLE_ROWS_OVERFLOWS:
+            raise ValueError(
+                f"example_rows_overflow must be one of {EXAMPLE_ROWS_OVERFLOWS}"
             )
-            return
-        filename = f"{self.out_dir}/{feature.name}.feature"
+        self._example_rows_overflow = value
 
-        logging.info(f"writing {feature.name} to {filename}")
-        with open(filename, "w") as feature_file:
-            feature_file.write(f"@{self.plan_id} @{feature.id}\n")
-            feature_file.write(
-                f"Feature: {feature.name}_{feature.id}_Revision_{feature.revision}\n\n"
+    @property
+    def snapshot_file(self):
+        return self._snapshot_file
+
+    @snapshot_file.setter
+    def snapshot_file(self, value):
+        self._snapshot_file = value
+
+    @property
+    def snapshot_mode(self):
+        """None to talk to ADO as normal, "record" to also save every ADO response
+        to snapshot_file, or "replay" to answer every request from snapshot_file
+        without connecting to ADO at all"""
+        return self._snapshot_mode
+
+    @snapshot_mode.setter
+    def snapshot_mode(self, value):
+        if value not in (None, "record", "replay"):
+            raise ValueError(
+                f'snapshot_mode must be None, "record" or "replay", not {value}'
             )
+        self._snapshot_mode = value
 
-            if feature.background is not None:
-                feature_file.write(
-                    f"\tBackground: {feature.background.name}_{feature.background.id}_Revision_{feature.background.revision}\n"
-                )  # noqa: E501
-                for step in feature.background.steps:
-                    feature_file.write(f"\t\t{step.text}\n")
-                feature_file.write("\n")
+    @property
+    def retain_work_items(self):
+        return self._retain_work_items
 
-            scenarios_written = 0
-            for scenario in feature.scenarios:
-                if self._write_scenario(scenario, feature, feature_file):
-                    scenarios_written += 1
+    @retain_work_items.setter
+    def retain_work_items(self, value):
+        """when False, the raw ADO work items are dropped once they have been
+        decoded, and Scenario.ado_work_item is left as None. On large plans,
+        they are most of the memory used."""
+        self._retain_work_items = value
 
-            if not scenarios_written:
-                logging.warning(
-                    f"No scenarios created for {feature} in {self.plan_id}. Check tags!"
-                )
+    @property
+    def incremental_write(self):
+        return self._incremental_write
+
+    @incremental_write.setter
+    def incremental_write(self, value):
+        """when True, out_dir is no longer cleared before feature files are written.
+        Only files whose contents changed are replaced, and only files of features
+        that no longer exist are deleted, so unchanged files keep their mtimes."""
+        self._incremental_write = value
+
+    @property
+    def extra_fields(self):
+        """work item fields to fetch on top of WORK_ITEM_FIELDS,
+        for callers that read more from Scenario.ado_work_item"""
+        return self._extra_fields
+
+    @extra_fields.setter
+    def extra_fields(self, value):
+        self._extra_fields = value
+
+    @property
+    def work_item_fields(self):
+        return WORK_ITEM_FIELDS + [
+            field for field in self.extra_fields if field not in WORK_ITEM_FIELDS
+        ]
+
+    @property
+    def watermark_file(self):
+        return self._watermark_file
+
+    @watermark_file.setter
+    def watermark_file(self, value):
+        self._watermark_file = value
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, value):
+        """setting a directory turns on the on-disk work item cache. For
+        non-default eviction limits, assign a WorkItemCache to
+        self.work_item_cache directly instead"""
+        self._cache_dir = value
+        self.work_item_cache = WorkItemCache(value) if value is not None else None
+
+    def _map_concurrently(self, fn, items: list):
+        """Like map(), but spreads the calls across up to self.max_workers threads.
+        Results are always yielded in the same order as items, so callers can
+        assemble them deterministically no matter which call finishes first.
+        Only a few calls are started ahead of the results being consumed, so
+        a slow consumer doesn't leave every result waiting in memory."""
+        if self.max_workers == 1 or len(items) <= 1:
+            yield from map(fn, items)
+            return
+        workers = min(self.max_workers, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            try:
+                for item in items:
+                    if len(pending) == 2 * workers:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(fn, item))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _feature_renderer(self):
+        return FeatureRenderer(
+            self.plan_id,
+            self.ignore_tags_list,
+            self.bdd_tp.shared_parameters,
+            examples_mode=self.examples_mode,
+            max_example_rows=self.max_example_rows,
+            example_rows_overflow=self.example_rows_overflow,
+        )
+
+    @timebudget
+    def _write_feature_file(self, feature: Feature, renderer: FeatureRenderer):
+        """This subroutine streams a feature's rendered contents into its file as
+        they are rendered, and returns its filename, or None if it has no file"""
+        if not renderer.has_file(feature):
+            return None
+        return self._write_rendered_feature(feature, renderer.iter_render(feature))
+
+    def _write_rendered_feature(self, feature: Feature, chunks):
+        """This subroutine writes a feature file from its rendered chunks (a list of
+        just one, if it was rendered elsewhere), and returns its filename, or None
+        if the feature had nothing to render"""
+        if chunks is None:
+            return None
+        filename = f"{self.out_dir}/{feature.name}.feature"
+        logging.info(f"writing {feature.name} to {filename}")
+        self._write_file(filename, chunks)
+        return f"{feature.name}.feature"
+
+    def _write_file(self, filename: str, chunks):
+        """This subroutine writes a rendered file, a chunk at a time. In
+        incremental_write mode, it's written beside the existing file and hashed on
+        the way. It's then swapped in if it differs, so the file is never seen half
+        written, and dropped if it doesn't, so the existing file is left alone."""
+        if not self.incremental_write:
+            with open(filename, "w") as file:
+                file.writelines(chunks)
+            return
+        temp_filename = f"{filename}.tmp"
+        try:
+            contents_hash = hashlib.sha256()
+            with open(temp_filename, "w") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    contents_hash.update(chunk.encode("utf-8"))
+            if self._hash_file(filename) == contents_hash.digest():
+                logging.info(f"{filename} is unchanged")
+            else:
+                os.replace(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    def _hash_file(self, filename: str):
+        """the hash of a file's contents as they would have been rendered,
+        or None if there is no such file to compare with"""
+        contents_hash = hashlib.sha256()
+        try:
+            with open(filename, "r") as file:
+                for line in file:
+                    contents_hash.update(line.encode("utf-8"))
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        return contents_hash.digest()
+
+    def _remove_stale_feature_files(self, written: set):
+        """In incremental_write mode, this subroutine deletes the feature file of
+        every feature that wasn't just written, and every runner that isn't
+        the runner of one that was"""
+        if not self.incremental_write:
+            return
+        runners = {
+            self._runner_filename(filename)
+            for filename in written
+            if filename is not None
+        }
+        for filename in os.listdir(self.out_dir):
+            if filename.endswith(".feature") and filename not in written:
+                logging.info(f"removing {filename}, its feature no longer exists")
+                os.remove(os.path.join(self.out_dir, filename))
+            elif self._is_runner_filename(filename) and filename not in runners:
+                logging.info(f"removing {filename}, its feature no longer exists")
+                os.remove(os.path.join(self.out_dir, filename))
 
     @timebudget
     def write_feature_files(self):
@@ -382,17 +1043,73 @@ class AzureDevOpsTestPlan:
         is assumed to have been populated previously"""
         if not self.bdd_tp.features:
             raise OrderOfOperationsError("BDD Test Plan has not been initialized")
+        self._prepare_out_dir()
+
+        logging.info("BEGIN FEATURE FILE WRITE")
+
+        written = set()
+        if self.render_processes == 1:
+            renderer = self._feature_renderer()
+            for feature in self.bdd_tp.features:
+                written.add(self._write_feature_file(feature, renderer))
+        else:
+            for feature, contents in zip(
+                self.bdd_tp.features, self._render_in_processes(self.bdd_tp.features)
+            ):
+                chunks = None if contents is None else [contents]
+                written.add(self._write_rendered_feature(feature, chunks))
+        self._remove_stale_feature_files(written)
+
+    def _render_in_processes(self, features: List[Feature]):
+        """This subroutine renders features across self.render_processes worker
+        processes, yielding each feature's contents in order as it's rendered.
+        The renderer is sent to each worker once, and features in chunks."""
+        chunksize = max(1, len(features) // (4 * self.render_processes))
+        with ProcessPoolExecutor(
+            max_workers=self.render_processes,
+            initializer=start_render_worker,
+            initargs=(self._feature_renderer(),),
+        ) as executor:
+            yield from executor.map(render_in_worker, features, chunksize=chunksize)
+
+    @timebudget
+    def populate_and_write_feature_files(self):
+        """this subroutine reads the test plan from ADO and writes its feature files
+        at the same time: each feature is handed to a writer thread as soon as
+        iter_features() yields it, while the next features are being fetched.
+        Only a few features are ever waiting to be written, so a slow disk
+        holds back the fetching rather than piling features up in memory."""
+        self._prepare_out_dir()
+
+        logging.info("BEGIN STREAMING FEATURE FILE WRITE")
+
+        written = set()
+        # only used by the writer thread. The shared parameters it merges for a
+        # feature have all been fetched by the time the feature is yielded
+        renderer = self._feature_renderer()
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            writes = deque()
+            for feature in self.iter_features():
+                if len(writes) > self.max_workers:
+                    written.add(writes.popleft().result())
+                writes.append(
+                    writer.submit(self._write_feature_file, feature, renderer)
+                )
+            while writes:
+                written.add(writes.popleft().result())
+        self._remove_stale_feature_files(written)
+
+    def _prepare_out_dir(self):
+        if self.incremental_write:
+            # files are only replaced as they change
+            os.makedirs(self.out_dir, exist_ok=True)
+            return
         if os.path.exists(self.out_dir):
             # if it exists delete it and all files in it
             shutil.rmtree(self.out_dir)
 
         os.makedirs(self.out_dir)
 
-        logging.info("BEGIN FEATURE FILE WRITE")
-
-        for feature in self.bdd_tp.features:
-            self._write_feature_file(feature)
-
     def _replace_placeholder(self, needed_fixture, defined_fixture):
         """this subroutine replaces the parse placeholders in G/W/T
         clauses with their variable names"""
@@ -595,21 +1312,53 @@ class AzureDevOpsTestPlan:
 
     @timebudget
     def _generate_pytestbdd_for_feature(self, feature):
-        output = subprocess.run(
-            ["pytest-bdd", "generate", f"{self.out_dir}/{feature}"], capture_output=True
-        )
+        """This subroutine generates the same code `pytest-bdd generate` prints for a
+        feature file, through pytest-bdd's own generation API rather than a new
+        process per feature. pytest-bdd is only a dev dependency, so without it
+        (or when it can't parse the feature file) this falls back to the
+        command, which reports the problem the way it always has."""
+        path = f"{self.out_dir}/{feature}"
+        try:
+            from pytest_bdd import feature as pytest_bdd_feature
+            from pytest_bdd.exceptions import FeatureError
+            from pytest_bdd.generation import generate_code, parse_feature_files
+        except ImportError as error:
+            logging.warning(f"Generating code with the pytest-bdd command: {error}")
+            return self._generate_pytestbdd_for_feature_in_subprocess(path)
+        # pytest-bdd caches every feature it parses by its absolute path, which
+        # would hand back the old parse of a feature file written over since
+        pytest_bdd_feature.features.pop(os.path.abspath(path), None)
+        try:
+            code = generate_code(*parse_feature_files([path]))
+        except (FeatureError, *PYTEST_BDD_API_ERRORS) as error:
+            logging.warning(
+                f"pytest-bdd could not generate code for {path} in process, "
+                + f"using the command instead: {error!r}"
+            )
+            return self._generate_pytestbdd_for_feature_in_subprocess(path)
+        # the command prints the code, so it ends with an extra newline
+        return code + "\n"
+
+    def _generate_pytestbdd_for_feature_in_subprocess(self, path):
+        output = subprocess.run(["pytest-bdd", "generate", path], capture_output=True)
         return StringIO(output.stdout.decode("utf-8")).getvalue()
 
     def _write_pytestbdd_runner_file_for_feature(self, feature):
         generated = self._generate_pytestbdd_for_feature(feature)
         scenario_runners = self._parse_scenario_runners_from_pytestbdd(generated)
         os.makedirs(self.out_dir, exist_ok=True)
-        test_name = feature.replace(".feature", "").lower().replace(" ", "_")
-        test_filename = "test_" + test_name + ".py"
+        test_filename = self._runner_filename(feature)
         with open(f"{self.out_dir}/{test_filename}", "w") as test_file:
             for i in scenario_runners:
                 test_file.write(f"{i}\n")
 
+    def _runner_filename(self, feature):
+        test_name = feature.replace(".feature", "").lower().replace(" ", "_")
+        return "test_" + test_name + ".py"
+
+    def _is_runner_filename(self, filename):
+        return filename.startswith("test_") and filename.endswith(".py")
+
     def _get_list_of_feature_files(self):
         if self.out_dir is None:
             raise OrderOfOperationsError(
@@ -617,10 +1366,12 @@ class AzureDevOpsTestPlan:
                     or written out the feature files for {self.plan_id}"
             )
         try:
+            # out_dir also holds the runners, and anything else put there
             files = [
                 f
                 for f in os.listdir(self.out_dir)
-                if os.path.isfile(os.path.join(self.out_dir, f))
+                if f.endswith(".feature")
+                and os.path.isfile(os.path.join(self.out_dir, f))
             ]
         except FileNotFoundError:
             raise OrderOfOperationsError(
@@ -646,9 +1397,136 @@ class AzureDevOpsTestPlan:
         for feature in self._get_list_of_feature_files():
             self._write_pytestbdd_runner_file_for_feature(feature)
 
+    @timebudget
+    def save_plan(self, path):
+        """This subroutine saves the populated plan (its ID, self.bdd_tp, when it
+        was last synced and the test cases in each suite) to a single gzipped
+        JSON file, which load_plan() can read back in another process instead
+        of calling populate() again. Scenario.ado_work_item is not saved."""
+        if not self.bdd_tp.features:
+            raise OrderOfOperationsError("BDD Test Plan has not been initialized")
+        shared_steps = {}
+        features = []
+        for feature in self.bdd_tp.features:
+            background = feature.background
+            features.append(
+                {
+                    "id": feature.id,
+                    "name": feature.name,
+                    "revision": feature.revision,
+                    "background": None
+                    if background is None
+                    else _encode_scenario(background, shared_steps),
+                    "scenarios": [
+                        _encode_scenario(scenario, shared_steps)
+                        for scenario in feature.scenarios
+                    ],
+                }
+            )
+        contents = {
+            "version": PLAN_FORMAT_VERSION,
+            "plan_id": self.plan_id,
+            "last_synced": None
+            if self.last_synced is None
+            else self.last_synced.isoformat(),
+            "shared_steps": {
+                id: expansion.contents for id, expansion in shared_steps.items()
+            },
+            # what is nested in each shared step, so that a load_plan() followed
+            # by populate() knows which expansions a changed shared step affects
+            "shared_step_nesting": {
+                id: expansion.nested_ids
+                for id, expansion in shared_steps.items()
+                if expansion.nested_ids
+            },
+            "features": features,
+            # JSON keys are always strings, so these are kept as a list
+            "shared_parameters": [
+                [
+                    id,
+                    shared_parameter.id,
+                    shared_parameter.revision,
+                    shared_parameter.parameters,
+                ]
+                for id, shared_parameter in self.bdd_tp.shared_parameters.items()
+            ],
+            # every test case in each suite, including those skipped for their
+            # tags or state, which populate() needs to tell when one changes
+            "suite_test_case_ids": [
+                [suite_id, test_case_ids]
+                for suite_id, test_case_ids in self._suite_test_case_ids.items()
+            ],
+        }
+        with gzip.open(path, "wt", encoding="utf-8") as plan_file:
+            json.dump(contents, plan_file, separators=(",", ":"))
+
+    @timebudget
+    def load_plan(self, path):
+        """This subroutine replaces self.bdd_tp with a plan saved by save_plan(),
+        after which the feature files and runners can be written and validated
+        as if populate() had been called"""
+        with gzip.open(path, "rt", encoding="utf-8") as plan_file:
+            contents = json.load(plan_file)
+        if contents.get("version") != PLAN_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is a version {contents.get('version')} plan, "
+                + f"only version {PLAN_FORMAT_VERSION} is supported"
+            )
+        # one expansion per shared step, shared by every step linked to it
+        nesting = contents.get("shared_step_nesting", {})
+        shared_steps = {
+            id: SharedStepExpansion(
+                id=int(id), contents=step_contents, nested_ids=nesting.get(id, [])
+            )
+            for id, step_contents in contents["shared_steps"].items()
+        }
+        bdd_tp = BDDTestPlan()
+        for encoded in contents["features"]:
+            background = encoded["background"]
+            bdd_tp.features.append(
+                Feature(
+                    id=encoded["id"],
+                    name=encoded["name"],
+                    revision=encoded["revision"],
+                    scenarios=[
+                        _decode_scenario(scenario, shared_steps)
+                        for scenario in encoded["scenarios"]
+                    ],
+                    background=None
+                    if background is None
+                    else _decode_scenario(background, shared_steps),
+                )
+            )
+        for key, id, revision, parameters in contents["shared_parameters"]:
+            bdd_tp.shared_parameters[key] = SharedParameters(
+                id=id, revision=revision, parameters=parameters
+            )
+        self.plan_id = contents["plan_id"]
+        self._suite_test_case_ids = {
+            suite_id: test_case_ids
+            for suite_id, test_case_ids in contents["suite_test_case_ids"]
+        }
+        self.last_synced = (
+            None
+            if contents["last_synced"] is None
+            else datetime.fromisoformat(contents["last_synced"])
+        )
+        self.bdd_tp = bdd_tp
+
     @timebudget
     def _open_ado_connection(self):
         """This subroutine uses azure-devops APIs to connect to ADO"""
+        if self.snapshot_mode is not None and self.snapshot_file is None:
+            raise OrderOfOperationsError(
+                f"snapshot_mode is {self.snapshot_mode} but there is no snapshot_file"
+            )
+        if self.snapshot_mode == "replay":
+            # everything will be answered from the snapshot instead
+            self.snapshot = Snapshot.load(self.snapshot_file)
+            self.connection = None
+            return
+        if self.snapshot_mode == "record":
+            self.snapshot = Snapshot()
         if self.pat is None:
             raise Exception("ADO Personal Access Token (PAT) is not set.")
         self.credentials = BasicAuthentication("", self.pat)
@@ -656,23 +1534,73 @@ class AzureDevOpsTestPlan:
             base_url=self.organization_url, creds=self.credentials
         )
 
-    def _get_ado_clients(self):
+    def _get_ado_clients(self, concurrency: int = None):
         """This subroutine gets all the different clients needed
-        to interact with ADO via REST APIs"""
-        clients = self.connection.clients
+        to interact with ADO via REST APIs. Each one is wrapped so that
+        its calls all go through a single RequestScheduler, which keeps
+        us under ADO's rate limits and retries throttled calls.
+
+        The scheduler starts out allowing concurrency (default: max_workers)
+        requests at once. Each of those may fetch work items on up to
+        max_workers threads of its own, so while ADO keeps up, it can grow
+        to max_workers times that."""
+        if concurrency is None:
+            concurrency = self.max_workers
+        self.scheduler = RequestScheduler(
+            max_concurrency=concurrency * self.max_workers,
+            initial_concurrency=concurrency,
+        )
 
-        self.test_plan_client = clients.get_test_plan_client()
+        self.test_plan_client = self._get_ado_client(
+            "test_plan_client", "get_test_plan_client"
+        )
         self.test_plan_client: TestPlanClient
 
-        self.test_client = clients.get_test_client()
+        self.test_client = self._get_ado_client("test_client", "get_test_client")
         self.test_client: TestClient
 
-        self.witc = clients.get_work_item_tracking_client()
+        self.witc = self._get_ado_client("witc", "get_work_item_tracking_client")
         self.witc: WorkItemTrackingClient
 
-        self.witpc = clients.get_work_item_tracking_process_client()
+        self.witpc = self._get_ado_client(
+            "witpc", "get_work_item_tracking_process_client"
+        )
         self.witpc: WorkItemTrackingProcessClient
 
+    def _get_ado_client(self, name, getter):
+        """gets one ADO client, or in replay mode, a stand-in that answers
+        from the snapshot. In record mode, the client records its responses."""
+        if self.snapshot_mode == "replay":
+            client = self.snapshot.replaying(name)
+        else:
+            client = getattr(self.connection.clients, getter)()
+            if self.snapshot_mode == "record":
+                client = self.snapshot.recording(client, name)
+        return self.scheduler.wrap(client, name)
+
+    def _share_ado_session(self, other: "AzureDevOpsTestPlan"):
+        """This subroutine points this plan at another plan's ADO connection,
+        clients, valid states, and work item caches, instead of its own.
+        populate() then skips connecting and looking up the valid states,
+        and any shared step or shared parameter already fetched for the
+        other plan (or any other plan sharing it) is not fetched again."""
+        self._session_source = other
+        self.connection = other.connection
+        self.snapshot = getattr(other, "snapshot", None)
+        self.scheduler = other.scheduler
+        self.test_plan_client = other.test_plan_client
+        self.test_client = other.test_client
+        self.witc = other.witc
+        self.witpc = other.witpc
+        self.valid_states = other.valid_states
+        self.work_item_cache = other.work_item_cache
+        self._shared_steps = other._shared_steps
+        self._shared_step_items = other._shared_step_items
+        self._shared_step_expansions = other._shared_step_expansions
+        self._shared_param_values = other._shared_param_values
+        self._shared_item_lock = other._shared_item_lock
+        self._shared_item_fetches = other._shared_item_fetches
+
     @timebudget
     def _get_azure_test_case_valid_states(self):
         """This subroutine queries the ADO project to get all the phases
@@ -732,7 +1660,53 @@ class AzureDevOpsTestPlan:
                 f"Found no populated test suites for {self.plan_id} under {self.project}"
             )
 
-    @timebudget
+    def _get_work_items(self, ids: list, fields: list = None, **kwargs):
+        """This subroutine is the one place work items are fetched in bulk.
+        Unless told otherwise, only self.work_item_fields are requested.
+
+        When the work item cache is on, it first fetches just the current
+        revision of each work item, which is a very small response, and only
+        fetches the full work item for those not already cached at that revision."""
+        if fields is None and "expand" not in kwargs:
+            fields = self.work_item_fields
+        kwargs["fields"] = fields
+        if self.work_item_cache is None:
+            return self._get_work_item_batches(ids, **kwargs)
+
+        revisions = {
+            work_item.id: work_item.rev
+            for work_item in self._get_work_item_batches(ids, fields=["System.Rev"])
+        }
+        work_items = {
+            id: self.work_item_cache.get(id, revisions.get(id), kwargs) for id in ids
+        }
+        misses = [id for id, work_item in work_items.items() if work_item is None]
+        logging.info(
+            f"work item cache: {len(ids) - len(misses)} hits, {len(misses)} misses"
+        )
+        for work_item in self._get_work_item_batches(misses, **kwargs):
+            self.work_item_cache.put(work_item, kwargs)
+            work_items[work_item.id] = work_item
+        return [work_items[id] for id in ids]
+
+    def _get_work_item_batches(self, ids: list, **kwargs):
+        """ADO caps how many IDs a single get_work_items request may carry, so
+        the IDs are split into chunks of at most WORK_ITEM_BATCH_SIZE, the
+        chunks are fetched in parallel, and the results are merged back
+        together in the order of ids."""
+        chunks = [
+            ids[start : start + WORK_ITEM_BATCH_SIZE]
+            for start in range(0, len(ids), WORK_ITEM_BATCH_SIZE)
+        ]
+
+        def get_chunk(chunk):
+            return self.witc.get_work_items(ids=chunk, project=self.project, **kwargs)
+
+        work_items = []
+        for chunk_work_items in self._map_concurrently(get_chunk, chunks):
+            work_items.extend(chunk_work_items)
+        return work_items
+
     def _get_azure_test_cases_for_test_suite(self, test_suite_id):
         """this subroutine popluates a list of ADO
         REST API TestCase objects"""
@@ -740,50 +1714,82 @@ class AzureDevOpsTestPlan:
             project=self.project, plan_id=self.plan_id, suite_id=test_suite_id
         )
 
+    def _get_azure_work_items_for_test_suite(self, test_suite: TestSuite):
+        """This subroutine does all of the ADO fetching for a single test suite,
+        returning the work items of every test case under it. It does not touch
+        self.bdd_tp, so it is safe to call from several threads at once."""
+        test_cases = self._get_azure_test_cases_for_test_suite(test_suite.id)
+        if not len(test_cases):
+            self._suite_test_case_ids[test_suite.id] = []
+            return []
+        # first we need to build an array of the the IDs
+        #  of all the test cases under this test suite
+        ids = []
+        for test_case in test_cases:
+            test_case: SuiteTestCase
+            # the test API hands back work item IDs as strings
+            test_case_id = int(test_case.test_case.id)
+            if test_case_id not in ids:
+                ids.append(test_case_id)
+        self._suite_test_case_ids[test_suite.id] = ids
+
+        # next, with that array of IDs, we can get the more
+        # generic ADO work items for those IDs
+        return self._get_work_items(ids)
+
+    def _get_unpopulated_azure_test_suites(self, features: List[Feature]):
+        """This subroutine returns the test suites from self._azure_test_suites
+        that do not yet have a feature of the same name in features"""
+        feature_names = [feature.name for feature in features]
+        test_suites = []
+        for test_suite in self._azure_test_suites:
+            if test_suite.name not in feature_names:
+                feature_names.append(test_suite.name)
+                test_suites.append(test_suite)
+        return test_suites
+
+    def _build_feature_from_azure_test_suite(
+        self, test_suite: TestSuite, scenario_work_items: list
+    ):
+        logging.info(f"Adding {test_suite.name} to {self.plan_id} features")
+        feature = Feature()
+        feature.name = test_suite.name
+        feature.id = test_suite.id
+        feature.revision = test_suite.revision
+        feature.background = None
+        self._populate_bdd_scenarios_from_azure_test_suite(
+            feature, test_suite, scenario_work_items
+        )
+        return feature
+
+    @timebudget
     def _populate_bdd_features_from_azure_test_suites(self):
         """This assumes _get_azure_test_suites has been called,
         and loops through the suite, checking to see if
         they are in a BDD test plan list, and adding them
         if they are not"""
-        for test_suite in self._azure_test_suites:
-            feature_names = (
-                [feature.name for feature in self.bdd_tp.features]
-                if self.bdd_tp.features
-                else []
+        test_suites = self._get_unpopulated_azure_test_suites(self.bdd_tp.features)
+
+        # only the fetching is spread across threads. The work items come back
+        # in suite order, so features (and the shared parameters they register)
+        # are always assembled in the same order regardless of max_workers
+        suite_work_items = self._map_concurrently(
+            self._get_azure_work_items_for_test_suite, test_suites
+        )
+        for test_suite, scenario_work_items in zip(test_suites, suite_work_items):
+            self.bdd_tp.features.append(
+                self._build_feature_from_azure_test_suite(
+                    test_suite, scenario_work_items
+                )
             )
-            if test_suite.name not in feature_names:
-                logging.info(f"Adding {test_suite.name} to {self.plan_id} features")
-                feature = Feature()
-                feature.name = test_suite.name
-                feature.id = test_suite.id
-                feature.revision = test_suite.revision
-                feature.background = None
-                self._populate_bdd_scenarios_from_azure_test_suite(feature, test_suite)
-                self.bdd_tp.features.append(feature)
 
     def _populate_bdd_scenarios_from_azure_test_suite(
-        self, feature: Feature, test_suite: TestSuite
+        self, feature: Feature, test_suite: TestSuite, scenario_work_items: list
     ):
-        """this subroutine assumes the test suite has been populated.
-        it then loops through this test suite, and builds up an
-        internal self.bdd_Test_plan"""
-        test_cases = self._get_azure_test_cases_for_test_suite(test_suite.id)
-        if len(test_cases):
-            # first we need to build an array of the the IDs
-            #  of all the test cases under this test suite
-            ids = []
-            for test_case in test_cases:
-                test_case: SuiteTestCase
-                if test_case.test_case.id not in ids:
-                    ids.append(test_case.test_case.id)
-
-            # next, with that array of IDs, we can get the more
-            # generic ADO work items for those IDs, and then
-            # loop through those work items, converting them to
-            # BDD style "scenarios"
-            scenario_work_items = self.witc.get_work_items(
-                ids=ids, project=self.project, expand="All"
-            )
+        """this subroutine takes the work items previously fetched for a test suite
+        and loops through them, converting them to BDD style "scenarios" in
+        the given feature"""
+        if len(scenario_work_items):
             for scenario_work_item in scenario_work_items:
                 scenario_work_item: WorkItem
 
@@ -794,35 +1800,38 @@ class AzureDevOpsTestPlan:
                     continue
 
                 # convert this ADO work item to a BDD Scenario.
+                # every field needed for that is decoded once, here
+                record = WorkItemRecord.from_work_item(
+                    scenario_work_item, retain_work_item=self.retain_work_items
+                )
 
                 # if it has shared parameters, that means we treat it as a
                 # scenario outline, which will have an examples table.
-                is_scenario_outline = self._has_params(scenario_work_item)
+                is_scenario_outline = record.has_params
 
                 # note that the contents of these shared parameters will come
                 # from a different ADO query
                 if is_scenario_outline:
-                    self._populate_shared_parameter_ids(scenario_work_item)
+                    self._populate_shared_parameter_ids(record)
 
                 # if it is called "background" that is a special title we are using
                 # to provide shared steps across all scenarios in the current feature
-                is_background = self._is_work_item_background(scenario_work_item)
-
-                tags = self._get_work_item_tags(scenario_work_item)
+                is_background = self._is_work_item_background(record)
 
                 scenario = Scenario()
-                scenario.name = scenario_work_item.fields["System.Title"]
-                scenario.id = scenario_work_item.id
-                scenario.revision = scenario_work_item.rev
-                scenario.tags = tags
+                scenario.name = record.title
+                scenario.id = record.id
+                scenario.revision = record.rev
+                scenario.tags = list(record.tags)
                 scenario.is_outline = is_scenario_outline
                 scenario.is_background = is_background
-                scenario.ado_work_item = scenario_work_item
+                scenario.ado_work_item = record.work_item
+                scenario.shared_parameter_ids = list(record.shared_parameter_ids)
 
                 if is_scenario_outline:
-                    self._populate_nonshared_parameters(scenario, scenario_work_item)
+                    self._populate_nonshared_parameters(scenario, record)
 
-                scenario.steps = self._populate_steps_for_work_item(scenario_work_item)
+                scenario.steps = self._populate_steps_for_work_item(record)
                 if is_background:
                     feature.background = scenario
                 else:
@@ -831,17 +1840,8 @@ class AzureDevOpsTestPlan:
         else:
             logging.warning(f"No test cases in suite: {test_suite.name}")
 
-    def _is_work_item_background(self, work_item: WorkItem):
-        return work_item.fields["System.Title"] == "Background"
-
-    def _get_work_item_tags(self, work_item: WorkItem):
-        tags = []
-        if "System.Tags" in work_item.fields:
-            tags = work_item.fields["System.Tags"]
-            tags = tags.replace(" ", "")
-            tags = tags.split(";")
-            tags = [tag for tag in tags if tag != ""]
-        return tags
+    def _is_work_item_background(self, record: WorkItemRecord):
+        return record.title == "Background"
 
     @timebudget
     def _get_azure_shared_params(self):
@@ -850,141 +1850,122 @@ class AzureDevOpsTestPlan:
         if they're not already populated"""
         if self.bdd_tp.shared_parameters:
             ids = list(self.bdd_tp.shared_parameters.keys())
-            shared_param_items = self.witc.get_work_items(ids=ids, project=self.project)
-
-            for shared_param_item in shared_param_items:
-                shared_param_item: WorkItem
-                id = shared_param_item.id
-                content = shared_param_item.fields["Microsoft.VSTS.TCM.Parameters"]
-
-                soup = BeautifulSoup(content, "html.parser")
-
-                for kvp in soup.find_all("kvp"):
-                    key = f'@{kvp.get("key")}'
-
-                    # special handling for ADOs weird thing where it
-                    # converts leading integers to an ascii code thing
-                    if key.startswith("@_x00"):
-                        phrases = key.split("_")
-                        ascii_char = chr(int(phrases[1][1:], 16))
-                        key = f'@{ascii_char}{"_".join(phrases[2:])}'
-
-                    # now, at the last-responsible-moment, remove the "@"
-                    # from the key, because that is only useful to azure,
-                    # not to pytest-bdd
-                    key = key.replace("@", "")
-
-                    if key not in self.bdd_tp.shared_parameters[id].parameters:
-                        self.bdd_tp.shared_parameters[id].parameters[key] = []
-                    self.bdd_tp.shared_parameters[id].parameters[key].append(
-                        kvp.get("value")
-                    )
-
-    def _has_shared_params(self, work_item: WorkItem):
-        """This subroutine checks to see if a work item has shared parameters
-        associated with it"""
-        if "Microsoft.VSTS.TCM.LocalDataSource" in work_item.fields and len(
-            work_item.fields["Microsoft.VSTS.TCM.LocalDataSource"]
-        ):
+            shared_param_values = self._fetch_shared_param_values(ids)
+            self._fill_shared_parameters(shared_param_values)
+
+    def _fetch_shared_param_values(self, ids):
+        """This subroutine returns the values of the shared parameter sets with the
+        given IDs, by ID, only fetching those not already in
+        self._shared_param_values. Only the values are kept, not the work items."""
+        self._fetch_shared_items(
+            ids, self._shared_param_values, self._decode_shared_param_item
+        )
+        with self._shared_item_lock:
+            return {id: self._shared_param_values[id] for id in ids}
+
+    def _fetch_shared_items(self, ids, items: dict, decode):
+        """This subroutine fetches the shared work items with the given IDs that
+        aren't in items yet, and puts each in items as decode makes it.
+
+        items may be shared with other plans (see _share_ado_session), but the
+        lock is only held to check and update it, never during a request, so
+        plans fetching different items don't wait on each other. An item
+        another caller is already fetching is waited on rather than fetched
+        again."""
+        waits = []
+        missing_ids = []
+        with self._shared_item_lock:
+            for id in dict.fromkeys(ids):
+                if id in items:
+                    continue
+                fetch = self._shared_item_fetches.get(id)
+                if fetch is None:
+                    missing_ids.append(id)
+                elif fetch not in waits:
+                    waits.append(fetch)
+            if missing_ids:
+                fetch = Future()
+                for id in missing_ids:
+                    self._shared_item_fetches[id] = fetch
+
+        if missing_ids:
             try:
-                params_fields = json.loads(
-                    work_item.fields["Microsoft.VSTS.TCM.LocalDataSource"]
-                )
-            except json.JSONDecodeError:
-                # a non-shared param, likely. process elsewhere.
-                return False
-            if len(params_fields["parameterMap"]):
-                return True
-        return False
-
-    def _populate_shared_parameter_ids(self, work_item: WorkItem):
-        try:
-            params_fields = json.loads(
-                work_item.fields["Microsoft.VSTS.TCM.LocalDataSource"]
-            )
-            for i in params_fields["parameterMap"]:
-                sharedParamsId = i["sharedParameterDataSetId"]
-                if sharedParamsId not in self.bdd_tp.shared_parameters:
-                    self.bdd_tp.shared_parameters[sharedParamsId] = SharedParameters()
-                    self.bdd_tp.shared_parameters[
-                        sharedParamsId
-                    ].revision = work_item.rev
-        except json.JSONDecodeError:
-            # a non-shared param, likely. process elsewhere.
-            pass
-        except KeyError:
-            logging.warning(
-                f"{work_item.id} has an unexpectedly empty parameters table"
-            )
+                decoded = [
+                    (work_item.id, decode(work_item))
+                    for work_item in self._get_work_items(missing_ids)
+                ]
+                with self._shared_item_lock:
+                    items.update(decoded)
+            except BaseException as error:
+                fetch.set_exception(error)
+                raise
+            else:
+                fetch.set_result(None)
+            finally:
+                with self._shared_item_lock:
+                    for id in missing_ids:
+                        self._shared_item_fetches.pop(id, None)
+        for wait in waits:
+            wait.result()
+
+    def _decode_shared_param_item(self, shared_param_item: WorkItem):
+        """This subroutine returns the values in a shared parameter work item,
+        as a tuple of values for each parameter name. Each has a value for
+        every data row, None where the row has none, so that the n-th values
+        of each parameter are still the ones from the n-th row."""
+        content = shared_param_item.fields["Microsoft.VSTS.TCM.Parameters"]
+        soup = BeautifulSoup(content, "html.parser")
+
+        rows = []
+        for data_row in soup.find_all("datarow") or [soup]:
+            row = {}
+            for kvp in data_row.find_all("kvp"):
+                key = f'@{kvp.get("key")}'
+
+                # special handling for ADOs weird thing where it
+                # converts leading integers to an ascii code thing
+                if key.startswith("@_x00"):
+                    phrases = key.split("_")
+                    ascii_char = chr(int(phrases[1][1:], 16))
+                    key = f'@{ascii_char}{"_".join(phrases[2:])}'
+
+                # now, at the last-responsible-moment, remove the "@"
+                # from the key, because that is only useful to azure,
+                # not to pytest-bdd
+                key = key.replace("@", "")
+
+                row.setdefault(key, kvp.get("value"))
+            rows.append(row)
+
+        keys = dict.fromkeys(key for row in rows for key in row)
+        return {key: tuple(row.get(key) for row in rows) for key in keys}
+
+    def _fill_shared_parameters(self, shared_param_values: dict):
+        """This subroutine fills in the values of the shared parameters in
+        self.bdd_tp from their freshly fetched values, replacing any values
+        they already had"""
+        for id, values in shared_param_values.items():
+            self.bdd_tp.shared_parameters[id].parameters = {
+                key: list(key_values) for key, key_values in values.items()
+            }
+
+    def _populate_shared_parameter_ids(self, record: WorkItemRecord):
+        for sharedParamsId in record.shared_parameter_ids:
+            if sharedParamsId not in self.bdd_tp.shared_parameters:
+                self.bdd_tp.shared_parameters[sharedParamsId] = SharedParameters()
+                self.bdd_tp.shared_parameters[sharedParamsId].revision = record.rev
+        if not record.shared_parameter_map_complete:
+            logging.warning(f"{record.id} has an unexpectedly empty parameters table")
             # this is PROBABLY an empty non-shared parameter,
             # but lets handle it elsewhere.
-            pass
 
-    def _has_params(self, work_item: WorkItem):
-        if "Microsoft.VSTS.TCM.Parameters" in work_item.fields and len(
-            work_item.fields["Microsoft.VSTS.TCM.Parameters"]
-        ):
-            parameter_table = work_item.fields["Microsoft.VSTS.TCM.Parameters"]
-            try:
-                table = ET.fromstring(parameter_table)
-            except ET.ParseError:
-                table = parameter_table
-            if len(table):
-                return True
-        if "Microsoft.VSTS.TCM.LocalDataSource" in work_item.fields and len(
-            work_item.fields["Microsoft.VSTS.TCM.LocalDataSource"]
-        ):
-            try:
-                params_fields = json.loads(
-                    work_item.fields["Microsoft.VSTS.TCM.LocalDataSource"]
-                )
-                if len(params_fields["parameterMap"]):
-                    return True
-            except json.JSONDecodeError:
-                pass
-        return False
-
-    def _populate_nonshared_parameters(self, scenario: Scenario, work_item: WorkItem):
-        try:
-            nonshared_parameter_table = work_item.fields[
-                "Microsoft.VSTS.TCM.Parameters"
-            ]
-        except KeyError:
-            # a shared param, likely. process elsewhere
-            return
-        try:
-            parameter_data_source = work_item.fields[
-                "Microsoft.VSTS.TCM.LocalDataSource"
-            ]
-        except KeyError:
-            raise InvalidParameterError(
-                f"Non-Shared parameter on {work_item.id} has no values"
-            )
-        try:
-            params = ET.fromstring(nonshared_parameter_table).findall("param")
-        except ET.ParseError:
-            # its just a string ID, shared param likely. process elsewhere.
-            return
-        try:
-            tables = ET.fromstring(parameter_data_source).findall("Table1")
-        except ET.ParseError:
-            # a shared param, likely. process elsewhere
-            return
-        if not len(tables):
-            raise InvalidParameterError(
-                "non-shared parameter on {work_item.id} has no table contents"
-            )
-        for param in params:  # not sure how fragile this is...
-            param_name = param.attrib["name"]
-            for table in tables:
-                for elem in table:
-                    tag = elem.tag  # don't need the @ here
-                    if param_name == tag:
-                        text = elem.text
-                        if tag not in scenario.non_shared_parameters:
-                            scenario.non_shared_parameters[tag] = []
-                        scenario.non_shared_parameters[tag].append(text)
-                        break
+    def _populate_nonshared_parameters(
+        self, scenario: Scenario, record: WorkItemRecord
+    ):
+        if record.non_shared_parameters_error is not None:
+            raise InvalidParameterError(record.non_shared_parameters_error)
+        for name, values in record.non_shared_parameters:
+            scenario.non_shared_parameters[name] = list(values)
 
     def _collect_steps_and_comprefs(self, element):
         """This subroutine iterates through a test case and finds all sets.
@@ -1024,23 +2005,17 @@ class AzureDevOpsTestPlan:
                 content = content.replace(word, updated_word)
         return content
 
-    def _populate_steps_for_work_item(self, work_item: WorkItem):
+    def _populate_steps_for_work_item(self, record: WorkItemRecord):
         """This subroutine iterates through all the steps associated with
         an ADO work item (Specifically a test case type of work item).
         It then returns a dictionary containing those steps."""
-        step_title = "Microsoft.VSTS.TCM.Steps"
-        if step_title in work_item.fields:
-            steps = work_item.fields[step_title]
-        else:
-            raise InvalidStepError(
-                f"{work_item.id}::{work_item.fields['System.Title']} has no steps"
-            )
+        if record.steps is None:
+            raise InvalidStepError(f"{record.id}::{record.title} has no steps")
 
         # now that we know this work item has some steps, lets see if they are
         # shared or unshared
         steps_for_item = []
-        root = ET.fromstring(steps)
-        all_elements = self._collect_steps_and_comprefs(root)
+        all_elements = self._collect_steps_and_comprefs(record.steps)
         for element in all_elements:
             if element.tag == "compref":
                 # compref inidicated a shared step, but its possible that
@@ -1054,30 +2029,24 @@ class AzureDevOpsTestPlan:
                 # this is a non-shared step. lets read it now.
                 parameterized_string_elements = element.findall("parameterizedString")
                 if parameterized_string_elements[0] is not None:
-                    soup = BeautifulSoup(
-                        parameterized_string_elements[0].text, "html.parser"
-                    )
-
                     # Find and extract the text content within the <P> element
-                    p = soup.find("p")
-                    if p:
-                        content = p.get_text().strip()  # remove trailing whitespace
+                    content = extract_step_text(parameterized_string_elements[0].text)
+                    if content is not None:
+                        content = content.strip()  # remove trailing whitespace
                         step = Step()
                         step.id = None
-                        step.revision = work_item.rev
-                        content = self._ado_to_pytest_bdd_notation(
-                            content, work_item.id
-                        )
+                        step.revision = record.rev
+                        content = self._ado_to_pytest_bdd_notation(content, record.id)
                         step.text = content
                         steps_for_item.append(step)
                         logging.warning(
-                            f"Test case is using a non-shared step when shared steps are recommended: {work_item.id}::{work_item.fields['System.Title']}"
+                            f"Test case is using a non-shared step when shared steps are recommended: {record.id}::{record.title}"
                         )  # noqa: E501
         return steps_for_item
 
     def _follow_compref(self, element):
         compref_steps = []
-        shared_step_id = element.get("ref")
+        shared_step_id = int(element.get("ref"))
         step = Step()
         step.id = shared_step_id
         # blank - will be linked later via a batched fetch
@@ -1085,7 +2054,7 @@ class AzureDevOpsTestPlan:
         compref_steps.append(step)
         return compref_steps
 
-    def _process_multiple_shared_steps(self, all_steps, id, title, rev):
+    def _process_multiple_shared_steps(self, all_steps, id, title, rev, path):
         step_content = []
         first_step = True
         contents_found = False
@@ -1096,20 +2065,8 @@ class AzureDevOpsTestPlan:
                         f"# Start Shared Steps for {id}: {title} Revision {rev}"
                     )
                     first_step = False
-                shared_step_id = sub_step.get("ref")
-                if shared_step_id not in self._shared_steps:
-                    logging.warning(
-                        f"recursively getting new shared step {shared_step_id}"
-                    )
-                    self._shared_steps[shared_step_id] = (
-                        self._parse_shared_step_content(
-                            self.witc.get_work_item(
-                                id=shared_step_id, project=self.project
-                            )
-                        )
-                    )
-
-                content = self._shared_steps[shared_step_id]
+                shared_step_id = int(sub_step.get("ref"))
+                content = self._expand_shared_step(shared_step_id, path)
                 if isinstance(content, list) and len(content):
                     step_content.extend(content)
                 elif len(content) and "\t\t" not in content:
@@ -1118,14 +2075,10 @@ class AzureDevOpsTestPlan:
             elif sub_step.tag == "step":
                 parameterized_string_elements = sub_step.findall("parameterizedString")
                 if parameterized_string_elements[0] is not None:
-                    soup = BeautifulSoup(
-                        parameterized_string_elements[0].text, "html.parser"
-                    )
-
                     # Find and extract the text content within the <P> element
-                    p = soup.find("p")
-                    if p:
-                        content = p.get_text().strip()
+                    content = extract_step_text(parameterized_string_elements[0].text)
+                    if content is not None:
+                        content = content.strip()
                         if content != "":
                             content = self._ado_to_pytest_bdd_notation(content, id)
                             contents_found = True
@@ -1148,11 +2101,9 @@ class AzureDevOpsTestPlan:
         # compare the element against the title?
         parameterized_string_elements = all_steps[0].findall("parameterizedString")
         # Find and extract the text content within the <P> element
-        p = BeautifulSoup(parameterized_string_elements[0].text, "html.parser").find(
-            "p"
-        )
-        if p:
-            content = p.get_text().strip()
+        content = extract_step_text(parameterized_string_elements[0].text)
+        if content is not None:
+            content = content.strip()
             if len(content):
                 if content != title:
                     content = self._ado_to_pytest_bdd_notation(content, id)
@@ -1169,37 +2120,27 @@ class AzureDevOpsTestPlan:
             step_content = self._ado_to_pytest_bdd_notation(title, id)
         return step_content
 
-    def _parse_shared_step_content(self, shared_step_item: WorkItem):
+    def _parse_shared_step_content(self, shared_step: WorkItemRecord, path=()):
         """This subroutine takes a shared step work item and parses out
-        every step from that work item into a list to populate step content with"""
+        every step from that work item into a list to populate step content with.
+        path holds the IDs of the shared steps being expanded that lead here,
+        ending with this one."""
         step_content = []
-        title = shared_step_item.fields["System.Title"]
-        self._shared_step_depth += 1
-        if self._shared_step_depth > 10:
-            raise RecursionError(
-                f"Too many nested shared steps, detected while processing {shared_step_item.id} ({title})"
-            )
-        elif "Microsoft.VSTS.TCM.Steps" in shared_step_item.fields:
-            steps_root = ET.fromstring(
-                shared_step_item.fields["Microsoft.VSTS.TCM.Steps"]
-            )
-            all_steps = self._collect_steps_and_comprefs(steps_root)
+        title = shared_step.title
+        if shared_step.steps is not None:
+            all_steps = self._collect_steps_and_comprefs(shared_step.steps)
             if len(all_steps) > 1:
                 step_content = self._process_multiple_shared_steps(
-                    all_steps, shared_step_item.id, title, shared_step_item.rev
+                    all_steps, shared_step.id, title, shared_step.rev, path
                 )
             elif len(all_steps) == 1:
                 step_content = self._process_single_shared_step(
-                    all_steps, shared_step_item.id, title, shared_step_item.rev
+                    all_steps, shared_step.id, title, shared_step.rev
                 )
             else:  # no steps - use the work-item title as the step contents
-                step_content = self._ado_to_pytest_bdd_notation(
-                    title, shared_step_item.id
-                )
+                step_content = self._ado_to_pytest_bdd_notation(title, shared_step.id)
         else:
-            step_content = [
-                self._ado_to_pytest_bdd_notation(title, shared_step_item.id)
-            ]
+            step_content = [self._ado_to_pytest_bdd_notation(title, shared_step.id)]
         return step_content
 
     @timebudget
@@ -1208,8 +2149,26 @@ class AzureDevOpsTestPlan:
         checks every step for a shared step ID and populates
         the step content accordingly. Batches all shared step items
         into a single call"""
+        ids = self._collect_shared_step_ids(self.bdd_tp.features)
+        if len(ids):
+            self._get_shared_steps(ids)
+        else:
+            logging.warning(f"No shared step IDs for plan {self.plan_id}")
+
+    def _get_shared_steps(self, ids):
+        """This subroutine fetches and expands the given shared steps. When the
+        shared step caches are shared with other plans, a shared step in use by
+        several of them is only fetched once, and the plans take turns at
+        expanding them."""
+        self._fetch_shared_step_items(ids)
+        with self._shared_item_lock:
+            self._parse_shared_step_items([self._shared_step_items[id] for id in ids])
+
+    def _collect_shared_step_ids(self, features):
+        """This subroutine returns the IDs of every shared step referenced
+        by the given features, in the order they are first referenced"""
         ids = []
-        for feature in self.bdd_tp.features:
+        for feature in features:
             if feature.background:
                 for step in feature.background.steps:
                     if step.id is not None and step.id not in ids:
@@ -1218,65 +2177,166 @@ class AzureDevOpsTestPlan:
                 for step in scenario.steps:
                     if step.id is not None and step.id not in ids:
                         ids.append(step.id)
+        return ids
+
+    def _collect_shared_step_expansions(self, features):
+        """This subroutine returns the SharedStepExpansions the steps of the
+        given features are linked to, by shared step ID"""
+        expansions = {}
+        for feature in features:
+            steps = list(feature.background.steps) if feature.background else []
+            for scenario in feature.scenarios:
+                steps.extend(scenario.steps)
+            for step in steps:
+                if step.shared_step is not None:
+                    expansions[step.shared_step.id] = step.shared_step
+        return expansions
+
+    def _get_nested_shared_step_ids(self, id):
+        """This subroutine returns the IDs of every shared step nested in the given
+        one, at any depth, from the shared step work items already fetched"""
+        nested_ids = []
+        level_ids = [id]
+        while level_ids:
+            next_ids = []
+            for level_id in level_ids:
+                shared_step_item = self._shared_step_items.get(level_id)
+                if shared_step_item is None:
+                    continue
+                for nested_id in self._get_shared_step_refs(shared_step_item):
+                    if nested_id != id and nested_id not in nested_ids:
+                        nested_ids.append(nested_id)
+                        next_ids.append(nested_id)
+            level_ids = next_ids
+        return nested_ids
+
+    def _get_shared_step_refs(self, shared_step: WorkItemRecord):
+        """This subroutine returns the IDs of the shared steps
+        a shared step references (comprefs) at any depth in its own steps"""
+        if shared_step.steps is None:
+            return []
+        return [
+            int(compref.get("ref")) for compref in shared_step.steps.iter("compref")
+        ]
 
-        if len(ids):
-            shared_step_items = self.witc.get_work_items(ids=ids, project=self.project)
-            for shared_step_item in shared_step_items:
-                id = shared_step_item.id
-                if id in self._shared_steps:
-                    logging.info(f"already fetched shared step {id}")
-                else:
-                    self._shared_step_depth = 0
-                    self._shared_steps[id] = self._parse_shared_step_content(
-                        shared_step_item
-                    )
-        else:
-            logging.warning(f"No shared step IDs for plan {self.plan_id}")
+    def _fetch_shared_step_items(self, ids):
+        """This subroutine fetches the given shared steps, and every shared step
+        nested inside them, into self._shared_step_items (as WorkItemRecords,
+        so each is only decoded once). It works breadth-first:
+        each round gathers every nested shared step not yet fetched across the
+        whole batch and fetches them together, so nesting costs one request
+        per level of depth rather than one per shared step. Shared steps that
+        were already fetched are still walked, since something nested in
+        them may not have been."""
+        visited_ids = set()
+        level_ids = list(ids)
+        while level_ids:
+            self._fetch_shared_items(
+                level_ids,
+                self._shared_step_items,
+                lambda shared_step_item: WorkItemRecord.from_work_item(
+                    shared_step_item, retain_work_item=self.retain_work_items
+                ),
+            )
+            with self._shared_item_lock:
+                level_items = [self._shared_step_items[id] for id in level_ids]
+            visited_ids.update(level_ids)
+            nested_ids = []
+            for shared_step_item in level_items:
+                for nested_id in self._get_shared_step_refs(shared_step_item):
+                    if nested_id not in visited_ids and nested_id not in nested_ids:
+                        nested_ids.append(nested_id)
+            level_ids = nested_ids
+
+    def _get_shared_step_item(self, id):
+        if id not in self._shared_step_items:
+            # should have been fetched along with its parent, but don't fail over it
+            logging.warning(f"shared step {id} was not prefetched, fetching it now")
+            # this is called while expanding, with the lock held, so it can't
+            # wait on a fetch in flight elsewhere, which needs the lock to finish
+            (shared_step_item,) = self._get_work_items([id])
+            self._shared_step_items[id] = WorkItemRecord.from_work_item(
+                shared_step_item, retain_work_item=self.retain_work_items
+            )
+        return self._shared_step_items[id]
 
-    def _link_shared_steps_back_to_bdd_scenarios(self):
+    def _parse_shared_step_items(self, shared_step_items: List[WorkItemRecord]):
+        for shared_step in shared_step_items:
+            if shared_step.id in self._shared_steps:
+                logging.info(f"already fetched shared step {shared_step.id}")
+            else:
+                self._expand_shared_step(shared_step.id)
+
+    def _expand_shared_step(self, id, path=()):
+        """This subroutine returns the expansion of a shared step, with every shared
+        step nested in it expanded in turn. Shared steps form a graph, in which
+        the same shared step may be nested in many others. Each is only expanded
+        once, the first time it is reached, and that expansion is reused from
+        self._shared_steps everywhere else it is nested.
+
+        path holds the IDs of the shared steps currently being expanded that
+        lead to this one, so that a shared step nested inside itself, however
+        indirectly, is reported along with the whole chain of nesting."""
+        if id in path:
+            cycle = " -> ".join(
+                f"{step_id} ({self._shared_step_items[step_id].title})"
+                for step_id in path + (id,)
+            )
+            raise SharedStepCycleError(f"Shared steps are nested in a cycle: {cycle}")
+        if id not in self._shared_steps:
+            if path:
+                logging.debug(f"expanding nested shared step {id}")
+            self._shared_steps[id] = self._parse_shared_step_content(
+                self._get_shared_step_item(id), path + (id,)
+            )
+        return self._shared_steps[id]
+
+    def _link_shared_steps_back_to_bdd_scenarios(self, features: List[Feature] = None):
         """there are no ADO queries here. This subroutine searches through all of the
-        placeholders in existing scenarios and populates them with the
-        shared step contents that have previously been fetched."""
-        if len(self._shared_steps):
-            for feature in self.bdd_tp.features:
-                if feature.background:
-                    for (
-                        shared_step_id,
-                        shared_step_contents,
-                    ) in self._shared_steps.items():  # noqa: E501
-                        for i in range(0, len(feature.background.steps)):
-                            if (
-                                feature.background.steps[i].id
-                                and int(feature.background.steps[i].id)
-                                == shared_step_id
-                            ):  # noqa: E501
-                                if isinstance(shared_step_contents, str):
-                                    feature.background.steps[
-                                        i
-                                    ].text = shared_step_contents  # noqa: E501
-                                else:
-                                    feature.background.steps[i].text = "\n".join(
-                                        shared_step_contents
-                                    )  # noqa: E501
-                for scenario_i in range(0, len(feature.scenarios)):
-                    for i in range(0, len(feature.scenarios[scenario_i].steps)):  # noqa: E501
-                        for (
-                            shared_step_id,
-                            shared_step_contents,
-                        ) in self._shared_steps.items():  # noqa: E501
-                            if (
-                                feature.scenarios[scenario_i].steps[i].id
-                                and int(feature.scenarios[scenario_i].steps[i].id)
-                                == shared_step_id
-                            ):  # noqa: E501
-                                if isinstance(shared_step_contents, str):
-                                    feature.scenarios[scenario_i].steps[
-                                        i
-                                    ].text = shared_step_contents  # noqa: E501
-                                else:
-                                    feature.scenarios[scenario_i].steps[
-                                        i
-                                    ].text = "\n".join(shared_step_contents)  # noqa: E501
+        placeholders in existing scenarios (or just those of the given features)
+        and populates them with the shared step contents that have previously
+        been fetched."""
+        if features is None:
+            features = self.bdd_tp.features
+        with self._shared_item_lock:
+            self._link_shared_steps(features)
+
+    def _link_shared_steps(self, features: List[Feature]):
+        for feature in features:
+            steps = list(feature.background.steps) if feature.background else []
+            for scenario in feature.scenarios:
+                steps.extend(scenario.steps)
+            for step in steps:
+                if step.id:
+                    expansion = self._get_shared_step_expansion(step.id)
+                    if expansion is not None:
+                        step.shared_step = expansion
+            # every step's text is final now, so this is
+            # the one time each outline is searched
+            for scenario in feature.scenarios:
+                if scenario.is_outline:
+                    scenario.placeholders = find_placeholders(
+                        step.text for step in scenario.steps
+                    )
+
+    def _get_shared_step_expansion(self, id):
+        """This subroutine returns the SharedStepExpansion that every step
+        referencing the given shared step is linked to, or None if that shared
+        step hasn't been expanded. There is only ever one per shared step, kept
+        by ID in self._shared_step_expansions, so a step holds a reference to it
+        rather than a copy of its text."""
+        expansion = self._shared_step_expansions.get(id)
+        if expansion is None:
+            contents = self._shared_steps.get(id)
+            if contents is None:
+                return None
+            expansion = SharedStepExpansion(
+                id=id,
+                contents=contents,
+                nested_ids=self._get_nested_shared_step_ids(id),
+            )
+            self._shared_step_expansions[id] = expansion
+        return expansion
 
     @timebudget
     def generate_usage_graph(self):
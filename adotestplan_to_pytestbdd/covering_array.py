@@ -0,0 +1,70 @@
+from itertools import combinations, product
+
+
+def covering_array(sizes: list, strength: int = 2):
+    """Returns rows that together contain every combination of values of any
+    strength parameters, usually far fewer rows than every combination of all
+    of them. Each parameter is given as its number of values, and each row is
+    a tuple of value indexes, one per parameter.
+
+    This is the IPOG (in-parameter-order) construction: the first strength
+    parameters start out fully combined, and each further parameter is added by
+    first picking, for every existing row, the value that covers the most
+    uncovered combinations, and then adding rows for any that still aren't.
+    It makes no random choices, so the same sizes always give the same rows."""
+    if any(size == 0 for size in sizes):
+        return []
+    if strength >= len(sizes):
+        return list(product(*(range(size) for size in sizes)))
+
+    rows = [list(row) for row in product(*(range(size) for size in sizes[:strength]))]
+    for parameter in range(strength, len(sizes)):
+        uncovered = set()
+        for others in combinations(range(parameter), strength - 1):
+            for values in product(*(range(sizes[other]) for other in others)):
+                for value in range(sizes[parameter]):
+                    uncovered.add((others, values + (value,)))
+
+        # horizontal growth: give every existing row its best value
+        for row in rows:
+            best_value, best_covered = 0, []
+            for value in range(sizes[parameter]):
+                covered = [
+                    combination
+                    for combination in _row_combinations(row, value, strength)
+                    if combination in uncovered
+                ]
+                if len(covered) > len(best_covered):
+                    best_value, best_covered = value, covered
+            row.append(best_value)
+            uncovered.difference_update(best_covered)
+
+        # vertical growth: fit each combination still uncovered into a row that
+        # doesn't care about its parameters yet, or else into a new row. Only
+        # rows with a parameter nothing has needed yet can take one
+        open_rows = [row for row in rows if None in row]
+        for others, values in sorted(uncovered):
+            parameters = others + (parameter,)
+            for row in open_rows:
+                if all(
+                    row[index] is None or row[index] == value
+                    for index, value in zip(parameters, values)
+                ):
+                    break
+            else:
+                row = [None] * (parameter + 1)
+                rows.append(row)
+                open_rows.append(row)
+            for index, value in zip(parameters, values):
+                row[index] = value
+
+    # any parameter that no combination needed takes its first value
+    return [tuple(0 if value is None else value for value in row) for row in rows]
+
+
+def _row_combinations(row: list, value: int, strength: int):
+    """every combination the row would cover with value as its next parameter"""
+    for others in combinations(range(len(row)), strength - 1):
+        values = tuple(row[other] for other in others)
+        if None not in values:
+            yield (others, values + (value,))
@@ -23,3 +23,15 @@ class InvalidParameterError(RuntimeError):
 
 class InvalidGherkinError(ParserError):
     pass
+
+
+class SnapshotMissError(LookupError):
+    pass
+
+
+class SharedStepCycleError(RecursionError):
+    pass
+
+
+class ExamplesTooLargeError(ValueError):
+    pass
@@ -0,0 +1,295 @@
+import logging
+import re
+from itertools import islice, product, zip_longest
+
+from timebudget import timebudget
+
+from adotestplan_to_pytestbdd.covering_array import covering_array
+from adotestplan_to_pytestbdd.exceptions import ExamplesTooLargeError
+
+
+# a scenario outline's <placeholder>, as written in its steps
+PLACEHOLDER = re.compile(r"<(.*?)>")
+
+
+def find_placeholders(texts):
+    """returns every placeholder in the given step texts, in the order
+    they first appear, and without duplicates"""
+    placeholders = {}
+    for text in texts:
+        for placeholder in PLACEHOLDER.findall(text):
+            placeholders[placeholder] = None
+    return list(placeholders)
+
+
+# Examples rows are streamed out this many at a time, which keeps
+# the memory a huge table takes bounded without a write per row
+EXAMPLE_ROWS_PER_CHUNK = 1000
+
+# how an outline's parameter values are combined into Examples rows. A mode
+# can also be "<t>way", e.g. "3way", of which "pairwise" is the same as "2way"
+EXAMPLES_MODES = ("product", "zip", "pairwise")
+T_WAY_EXAMPLES_MODE = re.compile(r"([1-9][0-9]*)way")
+
+# a scenario tagged examples_<mode>, e.g. examples_pairwise, uses that mode
+EXAMPLES_MODE_TAG_PREFIX = "examples_"
+
+# what happens when an outline would have more than max_example_rows rows
+EXAMPLE_ROWS_OVERFLOWS = ("warn", "error")
+
+
+def is_examples_mode(mode: str):
+    return mode in EXAMPLES_MODES or T_WAY_EXAMPLES_MODE.fullmatch(mode) is not None
+
+
+class FeatureRenderer:
+    """Renders features to the text of their feature files.
+
+    Rendering only reads the plan's model, never ADO or the disk, so this holds
+    just the parts of an AzureDevOpsTestPlan that it needs. That keeps it
+    picklable, so features can be rendered in worker processes (see
+    render_processes) while the plan itself writes the files. A renderer is
+    only meant for one pass over the plan, as the shared parameters it has
+    merged are kept for as long as it is.
+
+    A feature is rendered as a stream of chunks, the Examples rows one at a time,
+    so a huge Examples table goes straight to its file rather than being built
+    up in memory. The placeholders of an outline are the ones found when it was
+    linked (see Scenario.placeholders) rather than searched for again here."""
+
+    def __init__(
+        self,
+        plan_id,
+        ignore_tags_list: list,
+        shared_parameters: dict,
+        examples_mode: str = "product",
+        max_example_rows: int = None,
+        example_rows_overflow: str = "warn",
+    ):
+        self.plan_id = plan_id
+        self.ignore_tags_list = ignore_tags_list
+        self.shared_parameters = shared_parameters
+        self.examples_mode = examples_mode
+        self.max_example_rows = max_example_rows
+        self.example_rows_overflow = example_rows_overflow
+        # merged shared parameters, by the IDs of the sets they were merged from
+        self._merged_shared_parameters = {}
+
+    def has_file(self, feature):
+        """whether the feature gets a file at all, which it doesn't without scenarios"""
+        if not len(feature.scenarios):
+            logging.warning(
+                f"Feature {feature} has no scenarios in plan {self.plan_id}"
+            )
+            return False
+        return True
+
+    @timebudget
+    def render(self, feature):
+        """returns the contents of the feature's file, or None if it has no
+        scenarios and so shouldn't have a file"""
+        if not self.has_file(feature):
+            return None
+        return "".join(self.iter_render(feature))
+
+    def iter_render(self, feature):
+        """yields the contents of the feature's file, a chunk at a time"""
+        yield f"@{self.plan_id} @{feature.id}\n"
+        yield f"Feature: {feature.name}_{feature.id}_Revision_{feature.revision}\n\n"
+
+        background = feature.background
+        if background is not None:
+            yield f"\tBackground: {background.name}_{background.id}_Revision_{background.revision}\n"  # noqa: E501
+            yield "".join(f"\t\t{step.text}\n" for step in background.steps)
+            yield "\n"
+
+        scenarios_written = 0
+        for scenario in feature.scenarios:
+            yield from self._iter_scenario(scenario)
+            scenarios_written += 1
+
+        if not scenarios_written:
+            logging.warning(
+                f"No scenarios created for {feature} in {self.plan_id}. Check tags!"
+            )
+
+    def _iter_examples(self, scenario, examples_to_match):
+        """This subroutine will loop through the ADO shared parameters a given test
+        scenario references, and yield a gherkin formatted examples table from
+        them to be placed in the features file, a row at a time."""
+        # first, merge shared and non-shared
+        all_parameters, examples_version = self._merge_shared_parameters(
+            tuple(scenario.shared_parameter_ids)
+        )
+        if scenario.non_shared_parameters:
+            # these operations require python>=3.9
+            all_parameters = all_parameters | scenario.non_shared_parameters
+        if all(example in all_parameters for example in examples_to_match):
+            header = (
+                "\t\t\t| "
+                + " | ".join(example.center(30) for example in examples_to_match)
+                + " |\n"
+            )
+            # Iterate through each parameter set separately. A value is None
+            # where its row of the parameter table had none
+            parameter_sets = []
+            for example in examples_to_match:
+                parameter = all_parameters[example]
+                if isinstance(parameter, list):
+                    parameter_sets.append(
+                        [
+                            None if value is None else str(value).center(30)
+                            for value in parameter
+                        ]
+                    )
+                else:
+                    parameter_sets.append([str(parameter).center(30)])
+            # each value is only centered once, however many rows it's in
+            rows = [header]
+            for combo in self._limit_rows(scenario, parameter_sets):
+                rows.append("\t\t\t| " + " | ".join(combo) + " |\n")
+                if len(rows) == EXAMPLE_ROWS_PER_CHUNK:
+                    yield "".join(rows)
+                    rows = []
+            yield "".join(rows)
+        else:
+            missing_fields = [
+                example
+                for example in examples_to_match
+                if example not in all_parameters
+            ]
+            if missing_fields:
+                logging.warning(f"Outline Params not found:{', '.join(missing_fields)}")
+
+        yield "\n"
+        yield examples_version
+
+    def _merge_shared_parameters(self, shared_parameter_ids: tuple):
+        """returns the merged parameters of the given shared parameter sets, and
+        the version comment lines for them (none for non-shared parameters).
+        Many scenarios reference the same sets, so each combination of them is
+        only merged once, and the result must not be changed."""
+        merged = self._merged_shared_parameters.get(shared_parameter_ids)
+        if merged is None:
+            parameters = {}
+            examples_version = []
+            for shared_parameter_id in dict.fromkeys(shared_parameter_ids):
+                shared_parameter = self.shared_parameters.get(shared_parameter_id)
+                if shared_parameter is None:
+                    logging.warning(
+                        f"Shared Parameters {shared_parameter_id} were never fetched"
+                    )
+                    continue
+                examples_version.append(
+                    f"\t\t\t# Shared Parameters {shared_parameter_id}: Revision {shared_parameter.revision}\n"
+                )  # noqa: E501
+                # these operations require python>=3.9
+                parameters |= shared_parameter.parameters
+            merged = (parameters, "".join(examples_version))
+            self._merged_shared_parameters[shared_parameter_ids] = merged
+        return merged
+
+    def _limit_rows(self, scenario, parameter_sets):
+        """returns an iterator over the Examples rows of the given parameter values,
+        combined according to the scenario's examples mode, and at most
+        max_example_rows of them. The rows are counted before any is made, so an
+        outline that is too big is reported before anything of it is written."""
+        examples_mode = self._examples_mode_for(scenario)
+        t_way = T_WAY_EXAMPLES_MODE.fullmatch(examples_mode)
+        if examples_mode != "zip":
+            # only zip mode cares which row a value came from
+            parameter_sets = [
+                [value for value in values if value is not None]
+                for values in parameter_sets
+            ]
+        if examples_mode == "pairwise" or t_way is not None:
+            # only enough rows for every combination of values of any
+            # strength parameters, rather than of all of them
+            strength = 2 if t_way is None else int(t_way.group(1))
+            indexes = covering_array(
+                [len(values) for values in parameter_sets], strength
+            )
+            row_count = len(indexes)
+            rows = (
+                tuple(values[index] for values, index in zip(parameter_sets, row))
+                for row in indexes
+            )
+        elif examples_mode == "zip":
+            # the n-th value of every parameter makes up the n-th row, as ADO pairs
+            # them. A row without a value for a parameter, or a parameter with
+            # fewer values than others, is left blank
+            row_count = max((len(values) for values in parameter_sets), default=0)
+            blank = "".center(30)
+            rows = zip_longest(
+                *(
+                    [blank if value is None else value for value in values]
+                    for values in parameter_sets
+                ),
+                fillvalue=blank,
+            )
+        else:
+            row_count = 1
+            for values in parameter_sets:
+                row_count *= len(values)
+            rows = product(*parameter_sets)
+
+        if self.max_example_rows is None or row_count <= self.max_example_rows:
+            return rows
+        message = (
+            f"{scenario.name}_{scenario.id} has {row_count} Examples rows, "
+            + f"more than max_example_rows ({self.max_example_rows})"
+        )
+        if self.example_rows_overflow == "error":
+            raise ExamplesTooLargeError(message)
+        logging.warning(
+            f"{message}. Only the first {self.max_example_rows} are written"
+        )
+        return islice(rows, self.max_example_rows)
+
+    def _examples_mode_for(self, scenario):
+        """the examples mode of the scenario's first examples_<mode> tag,
+        or else examples_mode"""
+        for tag in scenario.tags:
+            if tag.startswith(EXAMPLES_MODE_TAG_PREFIX):
+                examples_mode = tag[len(EXAMPLES_MODE_TAG_PREFIX) :]
+                if is_examples_mode(examples_mode):
+                    return examples_mode
+                logging.warning(f"{scenario.id} has an unknown examples mode tag {tag}")
+        return self.examples_mode
+
+    def _iter_scenario(self, scenario):
+        logging.info(
+            f"Writing scenario: {scenario.name}_{scenario.id} Revision: {scenario.revision}"
+        )  # noqa: E501
+        tags = "".join(
+            f"@{tag} " for tag in scenario.tags if tag not in self.ignore_tags_list
+        )
+        keyword = "Scenario Outline" if scenario.is_outline else "Scenario"
+        steps = "".join(f"\t\t{step.text}\n" for step in scenario.steps)
+        yield (
+            f"\t@{scenario.id} {tags}\n"
+            + f"\t{keyword}: {scenario.name}_{scenario.id}_Revision_{scenario.revision}\n"
+            + f"{steps}\n"
+        )  # noqa: E501
+
+        if scenario.is_outline:
+            placeholders = scenario.placeholders
+            if placeholders is None:
+                # never linked, so never searched for its placeholders
+                placeholders = find_placeholders(step.text for step in scenario.steps)
+            yield "\t\tExamples:\n"
+            yield from self._iter_examples(scenario, placeholders)
+
+
+# each render worker process renders with the one FeatureRenderer it was started
+# with, rather than having it pickled along with every feature
+_worker_renderer = None
+
+
+def start_render_worker(renderer: FeatureRenderer):
+    global _worker_renderer
+    _worker_renderer = renderer
+
+
+def render_in_worker(feature):
+    return _worker_renderer.render(feature)
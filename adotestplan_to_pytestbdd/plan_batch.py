@@ -0,0 +1,99 @@
+import logging
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from timebudget import timebudget
+
+from adotestplan_to_pytestbdd.ado_test_plan import AzureDevOpsTestPlan
+
+
+class AzureDevOpsTestPlanBatch:
+    """Syncs many test plans from the same ADO project together.
+
+    Every plan shares one ADO connection and request scheduler, which starts
+    out allowing max_plans times max_workers requests at once, so that each
+    plan gets as many as it would on its own. The test case valid states are
+    only looked up once, and each shared step and shared
+    parameter is only fetched once no matter how many plans use it. Plans are
+    populated concurrently, and each is written to its own directory under
+    out_dir, named after its plan ID. Any other keyword arguments are passed
+    along to every AzureDevOpsTestPlan."""
+
+    def __init__(
+        self,
+        plan_ids: list,
+        pat=None,
+        organization_url: str = None,
+        project: str = None,
+        out_dir: str = "gen",
+        max_plans: int = 4,
+        profile=True,
+        **plan_options,
+    ):
+        if "watermark_file" in plan_options:
+            raise ValueError(
+                "Plans can't share a watermark_file, set one on each of test_plans instead"
+            )
+        self.profile = profile
+        self.out_dir = out_dir
+        self.max_plans = max_plans
+        # never populated itself, this holds the connection and caches every plan uses
+        self._session = AzureDevOpsTestPlan(
+            pat=pat,
+            organization_url=organization_url,
+            project=project,
+            profile=False,
+            **plan_options,
+        )
+        self.test_plans = [
+            AzureDevOpsTestPlan(
+                pat=pat,
+                organization_url=organization_url,
+                project=project,
+                id=plan_id,
+                out_dir=os.path.join(out_dir, str(plan_id)),
+                profile=False,
+                **plan_options,
+            )
+            for plan_id in plan_ids
+        ]
+
+    @property
+    def max_plans(self):
+        return self._max_plans
+
+    @max_plans.setter
+    def max_plans(self, value):
+        if value < 1:
+            raise ValueError(f"max_plans must be at least 1, not {value}")
+        self._max_plans = value
+
+    def populate(self):
+        """Reads every plan from ADO into its bdd_tp, up to max_plans at a time"""
+        self._open_session()
+
+        with warnings.catch_warnings():
+            # timebudget times each stage by name, and complains when the
+            # same stage is running for more than one plan at the same time
+            warnings.filterwarnings("ignore", message="timebudget is confused")
+            with ThreadPoolExecutor(max_workers=self.max_plans) as executor:
+                populated = executor.map(AzureDevOpsTestPlan.populate, self.test_plans)
+                for test_plan, _ in zip(self.test_plans, populated):
+                    logging.info(f"populated plan {test_plan.plan_id}")
+
+        if self.profile:
+            timebudget.report(reset=True)
+            self._session.scheduler.report()
+
+    def _open_session(self):
+        """connects to ADO once, for every plan"""
+        self._session._open_ado_connection()
+        self._session._get_ado_clients(self.max_plans * self._session.max_workers)
+        self._session._get_azure_test_case_valid_states()
+        for test_plan in self.test_plans:
+            test_plan._share_ado_session(self._session)
+
+    def write_feature_files(self):
+        for test_plan in self.test_plans:
+            test_plan.write_feature_files()
@@ -0,0 +1,188 @@
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+from azure.devops.exceptions import AzureDevOpsClientRequestError
+
+# the status codes ADO answers with when it is throttling us
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class RequestScheduler:
+    """Every ADO REST call made by an AzureDevOpsTestPlan goes through one of these.
+
+    It caps how many requests are in flight at once, and adapts that cap to
+    stay just under ADO's throttling: starting from initial_concurrency
+    (max_concurrency, if not given), the cap grows slowly up to
+    max_concurrency while responses come back healthy, and is halved whenever
+    ADO reports that it is delaying or rejecting our requests (X-RateLimit-*
+    headers, or a 429/503).
+    Throttled calls are retried once Retry-After has passed, rather than
+    failing the whole run. It also records how long every call took."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        initial_concurrency: int = None,
+    ):
+        if initial_concurrency is None:
+            initial_concurrency = max_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latencies = defaultdict(list)
+
+        self._condition = threading.Condition()
+        self._window = float(min(initial_concurrency, max_concurrency))
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_response = threading.local()
+
+    @property
+    def window(self):
+        """how many requests may currently be in flight at once"""
+        return max(1, int(self._window))
+
+    def wrap(self, client, name: str):
+        """Returns a stand-in for an azure-devops client whose
+        methods all go through this scheduler"""
+        self._watch(client)
+        return _ScheduledClient(self, client, name)
+
+    def _watch(self, client):
+        # every request an azure-devops client makes goes through its msrest
+        # ServiceClient.send, so that is where the response status and headers
+        # can be seen, even for requests that go on to raise an exception
+        service_client = getattr(client, "_client", None)
+        if service_client is None:
+            return
+        # clients are cached by the connection, so only ever wrap the original
+        if not hasattr(service_client, "_unscheduled_send"):
+            service_client._unscheduled_send = service_client.send
+        send = service_client._unscheduled_send
+
+        def send_and_record(*args, **kwargs):
+            response = send(*args, **kwargs)
+            self._last_response.value = response
+            return response
+
+        service_client.send = send_and_record
+
+    def call(self, name: str, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            self._last_response.value = None
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except AzureDevOpsClientRequestError:
+                response = self._last_response.value
+                status_code = getattr(response, "status_code", None)
+                if (
+                    status_code not in THROTTLED_STATUS_CODES
+                    or attempt == self.max_retries
+                ):
+                    raise
+                delay = self._retry_delay(response, attempt)
+                logging.warning(
+                    f"{name} was throttled ({status_code}), retrying in {delay:.1f}s"
+                )
+                self._throttled(delay)
+            else:
+                self.latencies[name].append(time.monotonic() - start)
+                self._adapt(self._last_response.value)
+                return result
+            finally:
+                self._release()
+
+    def report(self):
+        for name, latencies in sorted(self.latencies.items()):
+            logging.info(
+                f"{name}: {len(latencies)} calls, "
+                + f"mean {statistics.mean(latencies) * 1000:.0f}ms, "
+                + f"max {max(latencies) * 1000:.0f}ms"
+            )
+        logging.info(f"final request window: {self.window}")
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.window:
+                    self._condition.wait()
+                else:
+                    self._in_flight += 1
+                    return
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _retry_delay(self, response, attempt):
+        retry_after = _header_as_float(response, "Retry-After")
+        if retry_after is not None:
+            return retry_after
+        # no hint from ADO, so back off exponentially, with jitter so
+        # that every waiting thread doesn't come back at the same moment
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _throttled(self, delay):
+        with self._condition:
+            self._window = max(1.0, self._window / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._condition.notify_all()
+
+    def _adapt(self, response):
+        # ADO reports when it has started delaying our requests, or how much
+        # of our allowance remains, on otherwise successful responses
+        delayed = _header_as_float(response, "X-RateLimit-Delay")
+        remaining = _header_as_float(response, "X-RateLimit-Remaining")
+        limit = _header_as_float(response, "X-RateLimit-Limit")
+        nearly_throttled = remaining is not None and limit and remaining < limit / 10
+        with self._condition:
+            if delayed or nearly_throttled:
+                self._window = max(1.0, self._window / 2)
+            else:
+                self._window = min(
+                    float(self.max_concurrency), self._window + 1 / self._window
+                )
+            self._condition.notify_all()
+
+
+def _header_as_float(response, header):
+    if response is None or header not in response.headers:
+        return None
+    try:
+        return float(response.headers[header])
+    except ValueError:
+        return None
+
+
+class _ScheduledClient:
+    def __init__(self, scheduler: RequestScheduler, client, name: str):
+        self._scheduler = scheduler
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, attribute):
+        method = getattr(self._client, attribute)
+        if not callable(method):
+            return method
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(
+                f"{self._name}.{attribute}", method, *args, **kwargs
+            )
+
+        return scheduled
@@ -0,0 +1,133 @@
+import gzip
+import importlib
+import json
+import threading
+
+from msrest.serialization import Model
+
+from adotestplan_to_pytestbdd.exceptions import SnapshotMissError
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class Snapshot:
+    """Every ADO response seen during a populate(), keyed by the call that
+    produced it, so that populate() can later be re-run from a file instead of
+    a connection. Responses are kept as the plain JSON form of their azure-devops
+    models, and the whole snapshot is saved as a single gzipped JSON file."""
+
+    def __init__(self, responses: dict = None):
+        self.responses = {} if responses is None else responses
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+            contents = json.load(snapshot_file)
+        if contents.get("version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is a version {contents.get('version')} snapshot, "
+                + f"only version {SNAPSHOT_FORMAT_VERSION} is supported"
+            )
+        return cls(contents["responses"])
+
+    def save(self, path):
+        with self._lock:
+            contents = {"version": SNAPSHOT_FORMAT_VERSION, "responses": self.responses}
+            with gzip.open(path, "wt", encoding="utf-8") as snapshot_file:
+                json.dump(contents, snapshot_file, separators=(",", ":"))
+
+    def recording(self, client, name: str):
+        """Returns a stand-in for an azure-devops client that
+        records each response before passing it along"""
+        return _RecordingClient(self, client, name)
+
+    def replaying(self, name: str):
+        """Returns a stand-in for an azure-devops client
+        that answers each call from this snapshot"""
+        return _ReplayingClient(self, name)
+
+    def record(self, key: str, response):
+        encoded = _encode(response)
+        with self._lock:
+            self.responses[key] = encoded
+
+    def replay(self, key: str):
+        try:
+            encoded = self.responses[key]
+        except KeyError:
+            raise SnapshotMissError(
+                f"No recorded response for {key}. Was the snapshot recorded "
+                + "with the same plan and options?"
+            )
+        return _decode(encoded)
+
+
+def _call_key(name, method, args, kwargs):
+    arguments = json.dumps(_encode([args, kwargs]), sort_keys=True)
+    return f"{name}.{method}{arguments}"
+
+
+def _encode(value):
+    if isinstance(value, Model):
+        model = type(value)
+        return {
+            "__model__": f"{model.__module__}:{model.__qualname__}",
+            "data": value.as_dict(),
+        }
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if "__model__" in value:
+            module_name, class_name = value["__model__"].split(":")
+            # snapshots only ever hold azure-devops models, don't import anything else
+            if not module_name.startswith("azure.devops."):
+                raise ValueError(f"Unexpected model {value['__model__']} in snapshot")
+            model = getattr(importlib.import_module(module_name), class_name)
+            return model.from_dict(value["data"])
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+
+class _RecordingClient:
+    def __init__(self, snapshot: Snapshot, client, name: str):
+        self._snapshot = snapshot
+        self._wrapped = client
+        self._name = name
+
+    def __getattr__(self, attribute):
+        method = getattr(self._wrapped, attribute)
+        if not callable(method):
+            return method
+
+        def recorded(*args, **kwargs):
+            response = method(*args, **kwargs)
+            key = _call_key(self._name, attribute, args, kwargs)
+            self._snapshot.record(key, response)
+            return response
+
+        return recorded
+
+
+class _ReplayingClient:
+    def __init__(self, snapshot: Snapshot, name: str):
+        self._snapshot = snapshot
+        self._name = name
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+
+        def replayed(*args, **kwargs):
+            key = _call_key(self._name, attribute, args, kwargs)
+            return self._snapshot.replay(key)
+
+        return replayed
@@ -0,0 +1,128 @@
+import re
+
+from bs4 import BeautifulSoup
+
+# a start or end tag that html.parser would read the same way. Anything else
+# that starts with "<" (comments, declarations, odd tag names) is left to bs4
+_TAG = re.compile(
+    r"""<(?:/([a-zA-Z][a-zA-Z0-9]*)\s*"""
+    + r"""|([a-zA-Z][a-zA-Z0-9]*)"""
+    + r"""(?:\s+[^\s"'<>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'<>=`]+))?)*"""
+    + r"""\s*(/?))>"""
+)
+
+# the entities html.parser would decode exactly as html.unescape would. An
+# unknown entity, one missing its ";", or a character reference into the
+# windows-1252 range is each decoded in its own way, so those are left to bs4
+_ENTITY = re.compile(
+    r"(?:(amp|lt|gt|quot|apos|nbsp)|#([0-9]{1,7})|#[xX]([0-9a-fA-F]{1,6}));"
+)
+_NAMED_ENTITIES = {
+    "amp": "&",
+    "lt": "<",
+    "gt": ">",
+    "quot": '"',
+    "apos": "'",
+    "nbsp": "\xa0",
+}
+
+# elements whose contents html.parser doesn't read as markup,
+# or whose whitespace bs4 keeps as it is
+_UNHANDLED_TAGS = {"script", "style", "textarea", "title", "pre"}
+
+# the whitespace bs4 collapses, when a run of text holds nothing else
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# elements html.parser never expects a closing tag for
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "wbr"}
+
+
+class _Unhandled(Exception):
+    pass
+
+
+def extract_step_text(markup: str):
+    """Returns the text inside the first <P> of a step's parameterizedString
+    markup, exactly as BeautifulSoup(markup, "html.parser").find("p").get_text()
+    would, or None when there is no <P> at all.
+
+    ADO step markup is nearly always a plain <DIV><P>...</P></DIV>, with the odd
+    entity, <BR/>, or inline formatting tag, which is read here directly. Only
+    markup this doesn't understand is parsed with BeautifulSoup."""
+    if isinstance(markup, str):
+        try:
+            return _extract_step_text(markup)
+        except _Unhandled:
+            pass
+    p = BeautifulSoup(markup, "html.parser").find("p")
+    return p.get_text() if p is not None else None
+
+
+def _extract_step_text(markup: str):
+    position = 0
+    in_p = False
+    opened = []  # tags opened inside the <P> that haven't been closed yet
+    text = []
+    while True:
+        tag_start = markup.find("<", position)
+        if in_p:
+            end = len(markup) if tag_start == -1 else tag_start
+            text.append(_collapse_whitespace(_unescape(markup[position:end])))
+        if tag_start == -1:
+            if in_p:
+                # an unclosed <P>, which bs4 closes wherever its parent closes
+                raise _Unhandled()
+            return None
+        tag = _TAG.match(markup, tag_start)
+        if tag is None:
+            raise _Unhandled()
+        end_name, start_name, self_closing = tag.groups()
+        name = (end_name or start_name).lower()
+        if name in _UNHANDLED_TAGS:
+            raise _Unhandled()
+        if not in_p:
+            if name == "p" and start_name:
+                if self_closing:
+                    return ""
+                in_p = True
+        elif name == "p":
+            if start_name:
+                raise _Unhandled()  # a nested <P>, whose text is part of this one
+            return "".join(text)
+        elif end_name:
+            # closing a tag opened outside the <P> would also close the <P>
+            if name not in opened:
+                raise _Unhandled()
+            del opened[len(opened) - 1 - opened[::-1].index(name) :]
+        elif not self_closing and name not in _VOID_TAGS:
+            opened.append(name)
+        position = tag.end()
+
+
+def _collapse_whitespace(text: str):
+    if text and not text.strip(_ASCII_SPACES):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+def _unescape(text: str):
+    if "&" not in text:
+        return text
+    pieces = text.split("&")
+    unescaped = [pieces[0]]
+    for piece in pieces[1:]:
+        entity = _ENTITY.match(piece)
+        if entity is None:
+            raise _Unhandled()
+        name, decimal, hexadecimal = entity.groups()
+        if name is not None:
+            unescaped.append(_NAMED_ENTITIES[name])
+        else:
+            code_point = (
+                int(decimal, 10) if decimal is not None else int(hexadecimal, 16)
+            )
+            if not (0x20 <= code_point < 0x7F or 0xA0 <= code_point < 0xD800):
+                raise _Unhandled()
+            unescaped.append(chr(code_point))
+        unescaped.append(piece[entity.end() :])
+    return "".join(unescaped)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+
+class WorkItemCache:
+    """A local, on-disk cache of ADO work items, keyed by work item ID and
+    revision. Since ADO bumps a work item's revision on every change, a
+    cached copy with the same ID and revision as the server is known to
+    be current, and does not need to be fetched again.
+
+    Entries are evicted once they haven't been used for max_age seconds,
+    and least-recently-used entries are evicted whenever the cache grows
+    past max_size bytes."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int = 256 * 1024 * 1024,
+        max_age: float = 30 * 24 * 60 * 60,
+    ):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _variant(self, fetch_options: dict):
+        """the same work item fetched with different options (expand, fields...)
+        carries different content, so each set of options is cached separately"""
+        options = json.dumps(fetch_options, sort_keys=True)
+        return hashlib.sha1(options.encode("utf-8")).hexdigest()[:12]
+
+    def _path(self, id, rev, variant):
+        return self.directory / f"{id}-{rev}-{variant}.json"
+
+    def get(self, id, rev, fetch_options: dict = None):
+        """returns the cached work item for this ID and revision,
+        or None if there isn't one"""
+        path = self._path(id, rev, self._variant(fetch_options or {}))
+        try:
+            with open(path, "r") as cache_file:
+                work_item = WorkItem.from_dict(json.load(cache_file))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning(f"discarding unreadable work item cache entry {path}")
+            path.unlink(missing_ok=True)
+            return None
+        # keep track of use, so eviction drops the least recently used entries
+        os.utime(path)
+        return work_item
+
+    def put(self, work_item: WorkItem, fetch_options: dict = None):
+        variant = self._variant(fetch_options or {})
+        path = self._path(work_item.id, work_item.rev, variant)
+        # write then rename, so a reader never sees a partially written entry
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(handle, "w") as cache_file:
+            json.dump(work_item.as_dict(), cache_file)
+        os.replace(temp_path, path)
+        # older revisions of this work item will never be asked for again
+        for stale_path in self.directory.glob(f"{work_item.id}-*-{variant}.json"):
+            if stale_path != path:
+                stale_path.unlink(missing_ok=True)
+
+    def prune(self):
+        """evicts entries that are too old, then the least recently
+        used entries until the cache fits within max_size"""
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
@@ -0,0 +1,147 @@
+import json
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+
+@dataclass(frozen=True)
+class WorkItemRecord:
+    """A test case or shared step work item, with every field this package reads
+    already decoded. A work item is decoded once, when its record is made, and
+    everything downstream reads the record instead of the raw fields."""
+
+    id: int
+    rev: int
+    title: str
+    state: Optional[str]
+    tags: Tuple[str, ...]
+    # the parsed Microsoft.VSTS.TCM.Steps, or None if there are no steps
+    steps: Optional[ET.Element]
+    # whether the test case is parameterized at all, shared or not
+    has_params: bool
+    # the shared parameter sets the test case draws values from, in order
+    shared_parameter_ids: Tuple[int, ...]
+    # False if the shared parameter map was missing or malformed
+    shared_parameter_map_complete: bool
+    # (name, values) for each non-shared parameter, in the order they're declared.
+    # Each has a value for every row of the table, None where the row has none
+    non_shared_parameters: Tuple[Tuple[str, Tuple[Optional[str], ...]], ...]
+    # why the non-shared parameters are unusable, reported
+    # only if the test case turns out to be a scenario outline
+    non_shared_parameters_error: Optional[str]
+    # the raw work item, unless it wasn't retained
+    work_item: Optional[WorkItem] = field(repr=False, compare=False)
+
+    @classmethod
+    def from_work_item(cls, work_item: WorkItem, retain_work_item: bool = True):
+        fields = work_item.fields
+        parameters = fields.get("Microsoft.VSTS.TCM.Parameters")
+        data_source = fields.get("Microsoft.VSTS.TCM.LocalDataSource")
+
+        parameters_root = _parse_xml(parameters) if parameters else None
+        # shared parameters are mapped in a JSON data source,
+        # non-shared parameter values are in an XML one
+        data_source_json = _parse_json(data_source) if data_source else None
+        parameter_map = []
+        if isinstance(data_source_json, dict):
+            parameter_map = data_source_json.get("parameterMap", [])
+
+        has_params = bool(parameters) and (
+            # a non-XML parameters field still counts, as it did
+            parameters_root is None or len(parameters_root) > 0
+        )
+        has_params = has_params or bool(parameter_map)
+
+        shared_parameter_ids = []
+        shared_parameter_map_complete = isinstance(data_source_json, dict) and (
+            "parameterMap" in data_source_json
+        )
+        for mapping in parameter_map:
+            if "sharedParameterDataSetId" not in mapping:
+                shared_parameter_map_complete = False
+                break
+            shared_parameter_ids.append(mapping["sharedParameterDataSetId"])
+        if data_source is not None and data_source_json is None:
+            # an XML data source is for non-shared parameters, so nothing is missing
+            shared_parameter_map_complete = True
+
+        non_shared_parameters, non_shared_parameters_error = (
+            _decode_non_shared_parameters(
+                work_item.id,
+                parameters,
+                parameters_root,
+                data_source,
+                data_source_json,
+            )
+        )
+
+        steps = fields.get("Microsoft.VSTS.TCM.Steps")
+        tags = fields.get("System.Tags", "").replace(" ", "").split(";")
+        return cls(
+            id=work_item.id,
+            rev=work_item.rev,
+            title=fields.get("System.Title"),
+            state=fields.get("System.State"),
+            tags=tuple(tag for tag in tags if tag != ""),
+            steps=ET.fromstring(steps) if steps is not None else None,
+            has_params=has_params,
+            shared_parameter_ids=tuple(shared_parameter_ids),
+            shared_parameter_map_complete=shared_parameter_map_complete,
+            non_shared_parameters=non_shared_parameters,
+            non_shared_parameters_error=non_shared_parameters_error,
+            work_item=work_item if retain_work_item else None,
+        )
+
+
+def _parse_xml(text: str):
+    try:
+        return ET.fromstring(text)
+    except ET.ParseError:
+        return None
+
+
+def _parse_json(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def _decode_non_shared_parameters(
+    id, parameters, parameters_root, data_source, data_source_json
+):
+    """returns the non-shared parameter table as (name, values) pairs,
+    along with the reason it's unusable if it is"""
+    if parameters is None:
+        return (), None  # a shared param, likely
+    if data_source is None:
+        return (), f"Non-Shared parameter on {id} has no values"
+    if parameters_root is None:
+        return (), None  # its just a string ID, shared param likely
+    if data_source_json is not None:
+        return (), None  # a shared param
+    data_source_root = _parse_xml(data_source)
+    if data_source_root is None:
+        return (), None  # a shared param, likely
+    tables = data_source_root.findall("Table1")
+    if not len(tables):
+        return (), f"non-shared parameter on {id} has no table contents"
+
+    values = {}
+    for param in parameters_root.findall("param"):
+        param_name = param.get("name")
+        # one value per row, so that the n-th values of each parameter
+        # are still the ones from the n-th row
+        row_values = []
+        for table in tables:
+            for elem in table:
+                if param_name == elem.tag:
+                    row_values.append(elem.text or "")
+                    break
+            else:
+                row_values.append(None)
+        if any(value is not None for value in row_values):
+            values[param_name] = row_values
+    return tuple((name, tuple(texts)) for name, texts in values.items()), None
@@ -0,0 +1,95 @@
+"""Measures the memory a populated plan holds on to, with and without
+retain_work_items, and what slots save on the model classes themselves.
+
+    python benchmarks/bench_memory.py"""
+
+import gc
+import logging
+import tracemalloc
+from dataclasses import dataclass
+
+from azure.devops.v7_0.test_plan.models import TestSuite
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+from adotestplan_to_pytestbdd import ADOTestPlan, Step
+
+SCENARIOS = 2000
+STEPS_PER_SCENARIO = 12
+
+
+@dataclass
+class DictStep:
+    """Step as it was before slots, for comparison"""
+
+    id: int = 0
+    text: str = ""
+    revision: int = 0
+
+
+def step_xml(count):
+    steps = "".join(
+        f'<step id="{i + 1}" type="ActionStep">'
+        + '<parameterizedString isFormatted="true">'
+        + f"&lt;DIV&gt;&lt;P&gt;When the user performs action {i}&lt;/P&gt;&lt;/DIV&gt;"
+        + "</parameterizedString>"
+        + '<parameterizedString isFormatted="true">'
+        + "&lt;DIV&gt;&lt;P&gt;&lt;BR/&gt;&lt;/P&gt;&lt;/DIV&gt;"
+        + "</parameterizedString></step>"
+        for i in range(count)
+    )
+    return f'<steps id="0" last="{count}">{steps}</steps>'
+
+
+def work_items():
+    return [
+        WorkItem(
+            id=10000 + i,
+            rev=3,
+            fields={
+                "System.Title": f"Scenario {i}",
+                "System.State": "Design",
+                "System.Tags": "smoke; regression",
+                "Microsoft.VSTS.TCM.Steps": step_xml(STEPS_PER_SCENARIO),
+            },
+        )
+        for i in range(SCENARIOS)
+    ]
+
+
+def retained(make):
+    """the bytes still allocated by whatever make returns, once it has returned"""
+    gc.collect()
+    tracemalloc.start()
+    kept = make()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def populated_plan(retain_work_items):
+    test_plan = ADOTestPlan(id=1, profile=False, retain_work_items=retain_work_items)
+    suite = TestSuite(id=2, name="Memory Suite", revision=1)
+    # the raw work items are only referenced by the plan from here on
+    feature = test_plan._build_feature_from_azure_test_suite(suite, work_items())
+    test_plan.bdd_tp.features.append(feature)
+    return test_plan
+
+
+if __name__ == "__main__":
+    # every synthetic step is non-shared, which is warned about each time
+    logging.disable(logging.WARNING)
+    count = SCENARIOS * STEPS_PER_SCENARIO
+    slotted = retained(lambda: [Step(id=i, text="text") for i in range(count)])
+    plain = retained(lambda: [DictStep(id=i, text="text") for i in range(count)])
+    print(f"{count} steps")
+    print(f"  {'plain dataclass':<26}{plain / 1024:>10.0f} KiB")
+    print(f"  {'slotted dataclass':<26}{slotted / 1024:>10.0f} KiB")
+
+    kept = retained(lambda: populated_plan(retain_work_items=True))
+    dropped = retained(lambda: populated_plan(retain_work_items=False))
+    print(f"{SCENARIOS} scenarios of {STEPS_PER_SCENARIO} steps")
+    print(f"  {'retain_work_items=True':<26}{kept / 1024:>10.0f} KiB")
+    print(f"  {'retain_work_items=False':<26}{dropped / 1024:>10.0f} KiB")
+    print(f"  {'reduction':<26}{1 - dropped / kept:>10.0%}")
@@ -0,0 +1,92 @@
+"""Measures feature rendering throughput, in scenarios per second, on a
+synthetic plan shaped like a large real one.
+
+    python benchmarks/bench_render.py"""
+
+import logging
+import timeit
+
+from timebudget import timebudget
+
+from adotestplan_to_pytestbdd import Feature, Scenario, Step
+from adotestplan_to_pytestbdd.ado_test_plan import SharedParameters
+from adotestplan_to_pytestbdd.feature_renderer import (
+    FeatureRenderer,
+    find_placeholders,
+)
+
+FEATURES = 100
+SCENARIOS_PER_FEATURE = 50
+STEPS_PER_SCENARIO = 8
+# every third scenario is an outline
+OUTLINE_EVERY = 3
+
+
+def scenario(id):
+    is_outline = id % OUTLINE_EVERY == 0
+    steps = [
+        Step(id=None, text=f"When the user performs action {i}")
+        for i in range(STEPS_PER_SCENARIO - 2)
+    ]
+    if is_outline:
+        steps += [Step(id=None, text="Given the <Mode> mode at <Speed> speed")]
+        steps += [Step(id=None, text="Then the <Result> is shown")]
+    else:
+        steps += [Step(id=None, text="Given a step"), Step(id=None, text="Then done")]
+    return Scenario(
+        id=id,
+        revision=2,
+        name=f"Scenario {id}",
+        steps=steps,
+        tags=["smoke", "regression"],
+        is_outline=is_outline,
+        non_shared_parameters={"Result": ["pass", "fail"]} if is_outline else {},
+        shared_parameter_ids=[900] if is_outline else [],
+        # as linking would have found them
+        placeholders=find_placeholders(step.text for step in steps)
+        if is_outline
+        else None,
+    )
+
+
+def features():
+    return [
+        Feature(
+            id=feature_id,
+            name=f"Suite {feature_id}",
+            revision=1,
+            scenarios=[
+                scenario(feature_id * SCENARIOS_PER_FEATURE + i)
+                for i in range(SCENARIOS_PER_FEATURE)
+            ],
+        )
+        for feature_id in range(FEATURES)
+    ]
+
+
+def shared_parameters():
+    return {
+        900: SharedParameters(
+            revision=3,
+            parameters={
+                "Mode": ["eco", "normal", "boost", "max"],
+                "Speed": ["1", "2", "3"],
+            },
+        )
+    }
+
+
+if __name__ == "__main__":
+    # rendering logs every scenario at INFO, and those messages aren't measured
+    logging.disable(logging.WARNING)
+    timebudget.set_quiet()
+    plan = features()
+    renderer = FeatureRenderer(1, [], shared_parameters())
+    seconds = min(
+        timeit.repeat(
+            lambda: [renderer.render(feature) for feature in plan], number=1, repeat=5
+        )
+    )
+    scenarios = FEATURES * SCENARIOS_PER_FEATURE
+    print(f"{scenarios} scenarios ({scenarios // OUTLINE_EVERY} outlines)")
+    print(f"  {seconds * 1000:.1f} ms, {scenarios / seconds:,.0f} scenarios/s")
@@ -0,0 +1,40 @@
+"""Compares extract_step_text against the BeautifulSoup parse it replaces,
+on the kinds of step markup ADO produces.
+
+    python benchmarks/bench_step_text.py"""
+
+import timeit
+
+from bs4 import BeautifulSoup
+
+from adotestplan_to_pytestbdd.step_text import extract_step_text
+
+STEP_MARKUP = {
+    "plain": "<DIV><P>Given the device is powered on</P></DIV>",
+    "entities": "<DIV><DIV><P>When the user enters &quot;a &amp; b&quot;&nbsp;and @Parameter1</P></DIV></DIV>",
+    "formatted": '<DIV><P>Then the <B>status</B> is <span style="color:red">ready</span><BR/></P></DIV>',
+    "expected result": "<DIV><P><BR/></P></DIV>",
+    "fallback": "<DIV><P>Given a step with a <!-- comment --> in it</P></DIV>",
+}
+
+
+def soup_step_text(markup):
+    p = BeautifulSoup(markup, "html.parser").find("p")
+    return p.get_text() if p is not None else None
+
+
+def bench(fn, markup, number):
+    return min(timeit.repeat(lambda: fn(markup), number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    number = 2000
+    print(f"{'markup':<16}{'bs4 (us)':>12}{'extractor (us)':>16}{'speedup':>10}")
+    for name, markup in STEP_MARKUP.items():
+        assert extract_step_text(markup) == soup_step_text(markup)
+        soup_time = bench(soup_step_text, markup, number)
+        extractor_time = bench(extract_step_text, markup, number)
+        print(
+            f"{name:<16}{soup_time * 1e6:>12.1f}{extractor_time * 1e6:>16.1f}"
+            + f"{soup_time / extractor_time:>9.1f}x"
+        )
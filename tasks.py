@@ -19,6 +19,13 @@ def tests(c, log_level="error", tests: str = None):
     )
 
 
+@task
+def bench(c):
+    for benchmark in sorted(os.listdir("benchmarks")):
+        if benchmark.startswith("bench_") and benchmark.endswith(".py"):
+            c.run(f"poetry run python benchmarks/{benchmark}", pty=True)
+
+
 @task(aliases=["c"])
 def check(c):
     c.run("pre-commit run --all-files", pty=True)
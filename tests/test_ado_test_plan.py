@@ -1,15 +1,51 @@
+import asyncio
+import json
 import os
-
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from azure.devops._models import WrappedException
+from azure.devops.exceptions import AzureDevOpsServiceError
+from azure.devops.v7_0.test.models import SuiteTestCase
+from azure.devops.v7_0.test.models import WorkItemReference as SuiteWorkItemReference
+from azure.devops.v7_0.test_plan.models import TestPlan as ADOTestPlanModel
+from azure.devops.v7_0.test_plan.models import TestSuite as ADOTestSuite
+from azure.devops.v7_0.work_item_tracking.models import (
+    WorkItem,
+    WorkItemQueryResult,
+    WorkItemReference,
+)
 from dotenv import load_dotenv
 from pytest import fixture, raises
-
-from adotestplan_to_pytestbdd import ADOTestPlan
+from pytest_bdd import feature as pytest_bdd_feature
+from pytest_bdd import generation
+from pytest_bdd.exceptions import FeatureError
+
+from adotestplan_to_pytestbdd import (
+    ADOTestPlan,
+    ADOTestPlanBatch,
+    Feature,
+    Scenario,
+    Step,
+)
+from adotestplan_to_pytestbdd.ado_test_plan import (
+    WORK_ITEM_BATCH_SIZE,
+    WORK_ITEM_FIELDS,
+    SharedParameters,
+    SharedStepExpansion,
+)
 from adotestplan_to_pytestbdd.exceptions import (
     InvalidGherkinError,
     InvalidParameterError,
     MissingFixturesError,
     OrderOfOperationsError,
+    SharedStepCycleError,
 )
+from adotestplan_to_pytestbdd.work_item_record import WorkItemRecord
 
 root_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -105,6 +141,11 @@ def test_init_default_args():
     ADOTestPlan(organization_url=org_url, pat=pat)
 
 
+def test_init_invalid_max_workers():
+    with raises(ValueError):
+        ADOTestPlan(organization_url=org_url, pat=pat, max_workers=0)
+
+
 def test_populate_non_configured(default_tp):
     with raises(OrderOfOperationsError):
         default_tp.populate()
@@ -185,3 +226,679 @@ def test_empty_parameter_raises_exception(empty_parameters_tp):
 def test_validate_invalid_gherkin(invalid_gherkin_tp):
     with raises(InvalidGherkinError):
         invalid_gherkin_tp.populate()
+
+
+def test_concurrent_populate_matches_serial(tp_with_shared_steps_and_shared_params):
+    concurrent_tp = ADOTestPlan(
+        organization_url=org_url,
+        pat=pat,
+        project=proj,
+        id=tp_with_shared_steps_and_shared_params.plan_id,
+        max_workers=4,
+    )
+    concurrent_tp.populate()
+    tp_with_shared_steps_and_shared_params.populate()
+    assert concurrent_tp.bdd_tp == tp_with_shared_steps_and_shared_params.bdd_tp
+
+
+def test_apopulate_matches_populate(tp_with_shared_steps_and_shared_params):
+    async_tp = ADOTestPlan(
+        organization_url=org_url,
+        pat=pat,
+        project=proj,
+        id=tp_with_shared_steps_and_shared_params.plan_id,
+    )
+    asyncio.run(async_tp.apopulate(max_concurrency=4))
+    tp_with_shared_steps_and_shared_params.populate()
+    assert async_tp.bdd_tp == tp_with_shared_steps_and_shared_params.bdd_tp
+
+
+def test_get_work_items_is_batched(default_tp):
+    class BatchCheckingClient:
+        def get_work_items(self, ids, project=None, **kwargs):
+            assert len(ids) <= WORK_ITEM_BATCH_SIZE
+            return list(ids)
+
+    default_tp.witc = BatchCheckingClient()
+    default_tp.max_workers = 4
+    ids = list(range(WORK_ITEM_BATCH_SIZE * 2 + 1))
+    assert default_tp._get_work_items(ids) == ids
+
+
+def test_incremental_populate(tp_with_shared_steps_and_shared_params):
+    tp_with_shared_steps_and_shared_params.populate()
+    first_sync = tp_with_shared_steps_and_shared_params.last_synced
+    full_plan = deepcopy(tp_with_shared_steps_and_shared_params.bdd_tp)
+    # nothing has changed in between, so nothing should be rebuilt
+    tp_with_shared_steps_and_shared_params.populate()
+    assert tp_with_shared_steps_and_shared_params.bdd_tp == full_plan
+    assert tp_with_shared_steps_and_shared_params.last_synced > first_sync
+
+
+def test_get_work_items_projects_fields(default_tp):
+    class FieldCheckingClient:
+        def get_work_items(self, ids, project=None, fields=None, **kwargs):
+            assert fields == WORK_ITEM_FIELDS + ["Custom.Field"]
+            return list(ids)
+
+    default_tp.witc = FieldCheckingClient()
+    default_tp.extra_fields = ["Custom.Field", "System.Title"]
+    default_tp._get_work_items([1, 2, 3])
+
+
+def test_populate_and_write_feature_files(tp_with_shared_steps_and_shared_params):
+    tp_with_shared_steps_and_shared_params.populate()
+    tp_with_shared_steps_and_shared_params.write_feature_files()
+    written = sorted(os.listdir(tp_with_shared_steps_and_shared_params.out_dir))
+
+    streaming_tp = ADOTestPlan(
+        organization_url=org_url,
+        pat=pat,
+        project=proj,
+        id=tp_with_shared_steps_and_shared_params.plan_id,
+        out_dir="shared_steps_and_params_streamed",
+    )
+    streaming_tp.populate_and_write_feature_files()
+    assert sorted(os.listdir(streaming_tp.out_dir)) == written
+    assert not streaming_tp.bdd_tp.features
+
+
+def shared_step_record(id, step_text, nested_ids=()):
+    step = (
+        '<step id="1" type="ActionStep"><parameterizedString isFormatted="true">'
+        + f"&lt;DIV&gt;&lt;P&gt;{step_text}&lt;/P&gt;&lt;/DIV&gt;"
+        + "</parameterizedString></step>"
+    )
+    comprefs = "".join(f'<compref id="{id}" ref="{ref}" />' for ref in nested_ids)
+    work_item = WorkItem(
+        id=id,
+        rev=1,
+        fields={
+            "System.Title": f"Given shared step {id}",
+            "Microsoft.VSTS.TCM.Steps": f"<steps>{step}{comprefs}</steps>",
+        },
+    )
+    return WorkItemRecord.from_work_item(work_item)
+
+
+def test_shared_step_cycle_reports_path(default_tp):
+    default_tp._shared_step_items = {
+        1: shared_step_record(1, "Given one", [2]),
+        2: shared_step_record(2, "Given two", [3]),
+        3: shared_step_record(3, "Given three", [2]),
+    }
+    with raises(SharedStepCycleError, match=r"1 \(.*\) -> 2 .* -> 3 .* -> 2 "):
+        default_tp._get_shared_steps([1])
+
+
+def test_deeply_nested_shared_steps_expand_once(default_tp, monkeypatch):
+    # a long chain of shared steps, each also nesting the one two below it
+    depth = 20
+    default_tp._shared_step_items = {
+        id: shared_step_record(
+            id, f"Given step {id}", [n for n in (id + 1, id + 2) if n < depth]
+        )
+        for id in range(depth)
+    }
+    expanded = []
+    parse = default_tp._parse_shared_step_content
+
+    def counting_parse(shared_step, path=()):
+        expanded.append(shared_step.id)
+        return parse(shared_step, path)
+
+    monkeypatch.setattr(default_tp, "_parse_shared_step_content", counting_parse)
+    default_tp._get_shared_steps([0])
+    assert sorted(expanded) == list(range(depth))
+    assert "\t\tGiven step 19" in default_tp._shared_steps[0]
+
+
+def test_link_shared_steps(default_tp):
+    default_tp._shared_steps = {
+        1: "Given a single step",
+        2: ["# Shared step for 2", "\t\tGiven a nested step"],
+    }
+    scenario = Scenario(steps=[Step(id=1), Step(id=None, text="When unshared")])
+    other_scenario = Scenario(steps=[Step(id=2), Step(id=3)])
+    default_tp._link_shared_steps_back_to_bdd_scenarios(
+        [Feature(scenarios=[scenario, other_scenario])]
+    )
+    assert [step.text for step in scenario.steps] == [
+        "Given a single step",
+        "When unshared",
+    ]
+    # a shared step that was never expanded is left as a placeholder
+    assert [step.text for step in other_scenario.steps] == [
+        "# Shared step for 2\n\t\tGiven a nested step",
+        "",
+    ]
+
+
+def test_linked_steps_share_one_expansion(default_tp):
+    default_tp._shared_step_items = {1: shared_step_record(1, "Given a step")}
+    default_tp._get_shared_steps([1])
+    scenarios = [Scenario(steps=[Step(id=1)]) for _ in range(3)]
+    default_tp._link_shared_steps_back_to_bdd_scenarios([Feature(scenarios=scenarios)])
+    expansion = scenarios[0].steps[0].shared_step
+    assert all(scenario.steps[0].shared_step is expansion for scenario in scenarios)
+    assert scenarios[2].steps[0].text.endswith("\t\tGiven a step")
+
+    # re-linking after the shared step changes only swaps the reference
+    default_tp._forget_shared_steps({1})
+    default_tp._shared_step_items = {1: shared_step_record(1, "Given a changed step")}
+    default_tp._get_shared_steps([1])
+    default_tp._link_shared_steps_back_to_bdd_scenarios([Feature(scenarios=scenarios)])
+    assert scenarios[0].steps[0].shared_step is not expansion
+    assert all(
+        scenario.steps[0].text.endswith("\t\tGiven a changed step")
+        for scenario in scenarios
+    )
+
+
+def test_retain_work_items(default_tp):
+    work_item = WorkItem(
+        id=7,
+        rev=1,
+        fields={
+            "System.Title": "Scenario A",
+            "System.State": "Design",
+            "Microsoft.VSTS.TCM.Steps": '<steps><compref id="2" ref="800"/></steps>',
+        },
+    )
+    suite = ADOTestSuite(id=2, name="Suite", revision=1)
+    feature = default_tp._build_feature_from_azure_test_suite(suite, [work_item])
+    assert feature.scenarios[0].ado_work_item is work_item
+
+    default_tp.retain_work_items = False
+    feature = default_tp._build_feature_from_azure_test_suite(suite, [work_item])
+    assert feature.scenarios[0].ado_work_item is None
+    assert [step.id for step in feature.scenarios[0].steps] == [800]
+
+
+def test_shared_parameter_work_items_are_not_kept(default_tp):
+    class SharedParameterClient:
+        def get_work_items(self, ids, project=None, **kwargs):
+            parameters = (
+                '<parameterSet><paramData><dataRow id="1"><kvp key="_x0031_st"'
+                + ' value="a"/><kvp key="Two" value="b"/></dataRow></paramData>'
+                + "</parameterSet>"
+            )
+            return [
+                WorkItem(id=id, fields={"Microsoft.VSTS.TCM.Parameters": parameters})
+                for id in ids
+            ]
+
+    default_tp.witc = SharedParameterClient()
+    values = {"1st": ("a",), "Two": ("b",)}
+    assert default_tp._fetch_shared_param_values([900]) == {900: values}
+    assert default_tp._shared_param_values == {900: values}
+
+
+def test_shared_parameter_values_keep_their_data_rows(default_tp):
+    content = (
+        '<parameterSet><paramData><dataRow id="1"><kvp key="One" value="1"/>'
+        + '<kvp key="Two" value="a"/></dataRow><dataRow id="2">'
+        + '<kvp key="Two" value="b"/></dataRow><dataRow id="3">'
+        + '<kvp key="One" value="3"/></dataRow></paramData></parameterSet>'
+    )
+    work_item = WorkItem(id=900, fields={"Microsoft.VSTS.TCM.Parameters": content})
+    assert default_tp._decode_shared_param_item(work_item) == {
+        "One": ("1", None, "3"),
+        "Two": ("a", "b", None),
+    }
+
+
+def test_save_and_load_plan(default_tp, tmp_path):
+    expansion = SharedStepExpansion(id=800, contents=["# Shared", "\t\tGiven a step"])
+    default_tp.plan_id = 5
+    default_tp.bdd_tp.features = [
+        Feature(
+            id=10,
+            name="Suite",
+            revision=2,
+            background=Scenario(
+                id=11, name="Background", is_background=True, steps=[Step(id=1)]
+            ),
+            scenarios=[
+                Scenario(
+                    id=12,
+                    revision=3,
+                    name="Scenario A",
+                    tags=["smoke"],
+                    is_outline=True,
+                    non_shared_parameters={"One": ["1", "2"]},
+                    steps=[
+                        Step(id=800, shared_step=expansion),
+                        Step(id=None, text="Then <One>", revision=4),
+                    ],
+                ),
+                Scenario(id=13, steps=[Step(id=800, shared_step=expansion)]),
+            ],
+        )
+    ]
+    default_tp.bdd_tp.shared_parameters = {
+        900: SharedParameters(revision=3, parameters={"Parameter1": ["1"]})
+    }
+    default_tp.save_plan(tmp_path / "plan.json.gz")
+
+    loaded_tp = ADOTestPlan()
+    loaded_tp.load_plan(tmp_path / "plan.json.gz")
+    assert loaded_tp.plan_id == 5
+    assert loaded_tp.bdd_tp == default_tp.bdd_tp
+    # linked steps still share one expansion
+    scenarios = loaded_tp.bdd_tp.features[0].scenarios
+    assert scenarios[0].steps[0].shared_step is scenarios[1].steps[0].shared_step
+
+
+class StubADO:
+    """Stands in for every ADO client populate() uses, answering from a plan
+    with one suite of test cases. Work items can be changed between calls,
+    and changed_ids is what the WIQL query for changed work items returns,
+    unless it is None, for more changes than ADO will list."""
+
+    def __init__(self, test_case_ids, work_items):
+        self.test_case_ids = test_case_ids
+        self.work_items = {work_item.id: work_item for work_item in work_items}
+        self.changed_ids = []
+        self.queries = []
+
+    def install(self, tp, monkeypatch):
+        monkeypatch.setattr(tp, "_open_ado_connection", lambda: None)
+        monkeypatch.setattr(tp, "_get_ado_clients", lambda: None)
+        monkeypatch.setattr(tp, "_get_azure_test_case_valid_states", lambda: None)
+        tp.profile = False
+        tp.project = "Project"
+        tp.plan_id = 1
+        tp.test_plan_client = tp.test_client = tp.witc = self
+
+    def get_test_plan_by_id(self, project, plan_id):
+        return ADOTestPlanModel(id=plan_id, name="Plan")
+
+    def get_test_suites_for_plan(self, project, plan_id):
+        return [ADOTestSuite(id=2, name="Suite", revision=1)]
+
+    def get_test_cases(self, project, plan_id, suite_id):
+        return [
+            SuiteTestCase(test_case=SuiteWorkItemReference(id=str(id)))
+            for id in self.test_case_ids
+        ]
+
+    def get_work_items(self, ids, project=None, **kwargs):
+        return [self.work_items[id] for id in ids]
+
+    def query_by_wiql(self, wiql, **kwargs):
+        self.queries.append(wiql.query)
+        if self.changed_ids is None:
+            raise AzureDevOpsServiceError(
+                WrappedException(
+                    message="VS402337: The number of work items returned exceeds "
+                    + "the size limit of 20000."
+                )
+            )
+        return WorkItemQueryResult(
+            work_items=[WorkItemReference(id=id) for id in self.changed_ids]
+        )
+
+
+def scenario_work_item(id, title, steps="<steps></steps>"):
+    return WorkItem(
+        id=id,
+        rev=1,
+        fields={
+            "System.Title": title,
+            "System.State": "Design",
+            "Microsoft.VSTS.TCM.Steps": steps,
+        },
+    )
+
+
+def test_query_changed_work_item_ids(default_tp, monkeypatch):
+    ado = StubADO([], [])
+    ado.install(default_tp, monkeypatch)
+    default_tp.project = "Team's Project"
+    ado.changed_ids = [7, 8]
+    since = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    assert default_tp._query_changed_work_item_ids(since) == [7, 8]
+    assert "[System.TeamProject] = 'Team''s Project'" in ado.queries[0]
+    # with a margin for the server's clock
+    assert "[System.ChangedDate] > '2024-01-01T11:55:00Z'" in ado.queries[0]
+
+    ado.changed_ids = None
+    assert default_tp._query_changed_work_item_ids(since) is None
+
+
+def test_populate_falls_back_when_too_much_changed(default_tp, monkeypatch):
+    ado = StubADO([7], [scenario_work_item(7, "Scenario A")])
+    ado.install(default_tp, monkeypatch)
+    default_tp.populate()
+
+    ado.work_items[7] = scenario_work_item(7, "Scenario B")
+    ado.changed_ids = None
+    default_tp.populate()
+    assert [scenario.name for scenario in default_tp.bdd_tp.features[0].scenarios] == [
+        "Scenario B"
+    ]
+
+
+def test_iter_features_after_populate(default_tp, monkeypatch):
+    outline = scenario_work_item(7, "Scenario A")
+    outline.fields["Microsoft.VSTS.TCM.LocalDataSource"] = json.dumps(
+        {"parameterMap": [{"sharedParameterDataSetId": 900}]}
+    )
+    shared_parameters = WorkItem(
+        id=900,
+        rev=1,
+        fields={
+            "Microsoft.VSTS.TCM.Parameters": "<parameterSet><paramData>"
+            + '<dataRow id="1"><kvp key="One" value="1"/></dataRow>'
+            + '<dataRow id="2"><kvp key="One" value="2"/></dataRow>'
+            + "</paramData></parameterSet>"
+        },
+    )
+    ado = StubADO([7], [outline, shared_parameters])
+    ado.install(default_tp, monkeypatch)
+    default_tp.populate()
+    for _ in default_tp.iter_features():
+        pass
+    # the values are read again, not added to the ones already there
+    assert default_tp.bdd_tp.shared_parameters[900].parameters == {"One": ["1", "2"]}
+
+
+def test_shared_items_are_fetched_concurrently(default_tp):
+    fetched = []
+    both_fetching = threading.Barrier(2, timeout=5)
+
+    class ConcurrencyCheckingClient:
+        def get_work_items(self, ids, project=None, **kwargs):
+            fetched.extend(ids)
+            if ids != [3]:
+                # only returns once the other item is being fetched too
+                both_fetching.wait()
+            work_items = [
+                shared_step_record(id, f"Given step {id}").work_item for id in ids
+            ]
+            for work_item in work_items:
+                work_item.fields["Microsoft.VSTS.TCM.Parameters"] = "<parameterSet/>"
+            return work_items
+
+    default_tp.witc = ConcurrencyCheckingClient()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        fetches = [
+            executor.submit(default_tp._get_shared_steps, [1, 3]),
+            executor.submit(default_tp._fetch_shared_param_values, [2]),
+            executor.submit(default_tp._get_shared_steps, [3]),
+        ]
+        for fetch in fetches:
+            fetch.result()
+    assert sorted(fetched) == [1, 2, 3]
+    assert "\t\tGiven step 3" in default_tp._shared_steps[3]
+
+
+def test_load_plan_then_populate_finds_unskipped_test_cases(
+    default_tp, tmp_path, monkeypatch
+):
+    skipped = scenario_work_item(8, "Scenario B")
+    skipped.fields["System.State"] = "Closed"
+    ado = StubADO([7, 8], [scenario_work_item(7, "Scenario A"), skipped])
+    ado.install(default_tp, monkeypatch)
+    default_tp.ignore_states = ["Closed"]
+    default_tp.populate()
+    default_tp.save_plan(tmp_path / "plan.json.gz")
+
+    ado.work_items[8] = scenario_work_item(8, "Scenario B")
+    ado.changed_ids = [8]
+    loaded_tp = ADOTestPlan(ignore_states=["Closed"])
+    ado.install(loaded_tp, monkeypatch)
+    loaded_tp.load_plan(tmp_path / "plan.json.gz")
+    loaded_tp.populate()
+    assert [scenario.name for scenario in loaded_tp.bdd_tp.features[0].scenarios] == [
+        "Scenario A",
+        "Scenario B",
+    ]
+
+
+def test_load_plan_then_populate_relinks_changed_shared_steps(
+    default_tp, tmp_path, monkeypatch
+):
+    ado = StubADO(
+        [7],
+        [
+            scenario_work_item(7, "Scenario A", '<steps><compref ref="800"/></steps>'),
+            shared_step_record(800, "Given an outer step", [801]).work_item,
+            shared_step_record(801, "Given an inner step").work_item,
+        ],
+    )
+    ado.install(default_tp, monkeypatch)
+    default_tp.populate()
+    default_tp.save_plan(tmp_path / "plan.json.gz")
+
+    # only the nested shared step changes
+    ado.work_items[801] = shared_step_record(801, "Given a changed step").work_item
+    ado.changed_ids = [801]
+    loaded_tp = ADOTestPlan()
+    ado.install(loaded_tp, monkeypatch)
+    loaded_tp.load_plan(tmp_path / "plan.json.gz")
+    loaded_tp.populate()
+    text = loaded_tp.bdd_tp.features[0].scenarios[0].steps[0].text
+    assert "Given a changed step" in text
+    assert "Given an inner step" not in text
+
+
+def test_save_plan_without_populating(default_tp, tmp_path):
+    with raises(OrderOfOperationsError):
+        default_tp.save_plan(tmp_path / "plan.json.gz")
+
+
+def test_incremental_write(default_tp, tmp_path):
+    default_tp.out_dir = str(tmp_path)
+    default_tp.incremental_write = True
+    unchanged = Feature(id=1, name="Unchanged", scenarios=[Scenario(id=10)])
+    changed = Feature(id=2, name="Changed", scenarios=[Scenario(id=20)])
+    removed = Feature(id=3, name="Removed", scenarios=[Scenario(id=30)])
+    default_tp.bdd_tp.features = [unchanged, changed, removed]
+    default_tp.write_feature_files()
+    (tmp_path / "test_removed.py").write_text("")
+    (tmp_path / "conftest.py").write_text("")
+    unchanged_mtime = os.stat(tmp_path / "Unchanged.feature").st_mtime_ns
+
+    changed.scenarios[0].revision = 2
+    default_tp.bdd_tp.features = [unchanged, changed]
+    default_tp.write_feature_files()
+    assert os.stat(tmp_path / "Unchanged.feature").st_mtime_ns == unchanged_mtime
+    assert "_Revision_2" in (tmp_path / "Changed.feature").read_text()
+    assert sorted(os.listdir(tmp_path)) == [
+        "Changed.feature",
+        "Unchanged.feature",
+        "conftest.py",
+    ]
+
+
+def test_incremental_write_with_runners(default_tp, tmp_path):
+    default_tp.out_dir = str(tmp_path)
+    default_tp.incremental_write = True
+    kept = Feature(id=1, name="Kept", scenarios=[Scenario(id=10)])
+    removed = Feature(id=2, name="Removed", scenarios=[Scenario(id=20)])
+    default_tp.bdd_tp.features = [kept, removed]
+    default_tp.write_feature_files()
+    default_tp.write_pytestbdd_runners()
+
+    default_tp.bdd_tp.features = [kept]
+    default_tp.write_feature_files()
+    # last run's runners aren't taken for feature files
+    assert default_tp._get_list_of_feature_files() == ["Kept.feature"]
+    default_tp.write_pytestbdd_runners()
+    assert sorted(os.listdir(tmp_path)) == ["Kept.feature", "test_kept.py"]
+
+
+def outline_features(count):
+    return [
+        Feature(
+            id=feature_id,
+            name=f"Suite {feature_id}",
+            scenarios=[
+                Scenario(
+                    id=feature_id * 10,
+                    is_outline=True,
+                    tags=["smoke"],
+                    non_shared_parameters={"One": ["1", "2"], "Two": ["a", "b", "c"]},
+                    steps=[Step(text="Given <One>"), Step(text="Then <Two>")],
+                )
+            ],
+        )
+        for feature_id in range(1, count + 1)
+    ]
+
+
+def test_generate_matches_command(default_tp, tmp_path):
+    default_tp.out_dir = str(tmp_path)
+    default_tp.bdd_tp.features = outline_features(2)
+    default_tp.write_feature_files()
+    for feature in sorted(os.listdir(tmp_path)):
+        expected = default_tp._generate_pytestbdd_for_feature_in_subprocess(
+            f"{tmp_path}/{feature}"
+        )
+        assert default_tp._generate_pytestbdd_for_feature(feature) == expected
+
+
+def test_generate_after_rewriting_feature(default_tp, tmp_path):
+    default_tp.out_dir = str(tmp_path)
+    default_tp.bdd_tp.features = outline_features(1)
+    default_tp.write_feature_files()
+    (filename,) = os.listdir(tmp_path)
+    path = f"{tmp_path}/{filename}"
+    default_tp._generate_pytestbdd_for_feature(filename)
+
+    default_tp.bdd_tp.features[0].scenarios[0].name = "Renamed"
+    default_tp.write_feature_files()
+    # whatever pytest-bdd made of the old file is stale now
+    stale = pytest_bdd_feature.features.setdefault(os.path.abspath(path), object())
+    generated = default_tp._generate_pytestbdd_for_feature(filename)
+    assert pytest_bdd_feature.features.get(os.path.abspath(path)) is not stale
+    assert generated == default_tp._generate_pytestbdd_for_feature_in_subprocess(path)
+
+
+def test_generate_falls_back_to_command(default_tp, monkeypatch):
+    monkeypatch.setattr(
+        default_tp,
+        "_generate_pytestbdd_for_feature_in_subprocess",
+        lambda path: f"generated {path}",
+    )
+    default_tp.out_dir = "out"
+
+    # a feature file pytest-bdd can't parse
+    def failing_parse(paths):
+        raise FeatureError("Unexpected line", 1, "Feature", paths[0])
+
+    monkeypatch.setattr(generation, "parse_feature_files", failing_parse)
+    assert (
+        default_tp._generate_pytestbdd_for_feature("Suite.feature")
+        == "generated out/Suite.feature"
+    )
+
+    # pytest-bdd not being installed at all
+    monkeypatch.setitem(sys.modules, "pytest_bdd.generation", None)
+    assert (
+        default_tp._generate_pytestbdd_for_feature("Suite.feature")
+        == "generated out/Suite.feature"
+    )
+
+
+def test_render_processes_matches_serial(default_tp, tmp_path):
+    default_tp.bdd_tp.features = outline_features(5)
+    default_tp.out_dir = str(tmp_path / "serial")
+    default_tp.write_feature_files()
+
+    default_tp.render_processes = 2
+    default_tp.out_dir = str(tmp_path / "parallel")
+    default_tp.write_feature_files()
+    for filename in os.listdir(tmp_path / "serial"):
+        serial = (tmp_path / "serial" / filename).read_bytes()
+        assert (tmp_path / "parallel" / filename).read_bytes() == serial
+
+
+def test_init_invalid_examples_mode():
+    with raises(ValueError):
+        ADOTestPlan(examples_mode="4ways")
+
+
+def test_init_invalid_render_processes():
+    with raises(ValueError):
+        ADOTestPlan(render_processes=0)
+
+
+def test_link_finds_outline_placeholders(default_tp):
+    default_tp._shared_steps = {1: "Given <Two> and <One>"}
+    outline = Scenario(
+        is_outline=True,
+        steps=[Step(id=None, text="When <One>"), Step(id=1)],
+    )
+    scenario = Scenario(steps=[Step(id=None, text="When <One>")])
+    default_tp._link_shared_steps_back_to_bdd_scenarios(
+        [Feature(scenarios=[outline, scenario])]
+    )
+    assert outline.placeholders == ["One", "Two"]
+    assert scenario.placeholders is None
+
+
+def test_batch_populate_matches_populate(
+    tp_with_shared_steps_and_shared_params, tp_with_non_shared_params
+):
+    single_tps = [tp_with_shared_steps_and_shared_params, tp_with_non_shared_params]
+    batch = ADOTestPlanBatch(
+        [tp.plan_id for tp in single_tps],
+        organization_url=org_url,
+        pat=pat,
+        project=proj,
+        out_dir="batch",
+    )
+    batch.populate()
+    for batch_tp, single_tp in zip(batch.test_plans, single_tps):
+        single_tp.populate()
+        assert batch_tp.bdd_tp == single_tp.bdd_tp
+        assert batch_tp.out_dir == os.path.join("batch", single_tp.plan_id)
+
+
+def test_batch_plans_make_requests_concurrently(monkeypatch):
+    both_fetching = threading.Barrier(2, timeout=5)
+
+    class ConcurrencyCheckingClient:
+        def get_work_items(self, ids, **kwargs):
+            # only returns once the other plan's request is in flight too
+            both_fetching.wait()
+            return ids
+
+    client = ConcurrencyCheckingClient()
+    batch = ADOTestPlanBatch(["1", "2"], max_plans=2)
+    clients = SimpleNamespace(
+        **{
+            getter: lambda: client
+            for getter in (
+                "get_test_plan_client",
+                "get_test_client",
+                "get_work_item_tracking_client",
+                "get_work_item_tracking_process_client",
+            )
+        }
+    )
+    monkeypatch.setattr(
+        batch._session,
+        "_open_ado_connection",
+        lambda: setattr(batch._session, "connection", SimpleNamespace(clients=clients)),
+    )
+    monkeypatch.setattr(
+        batch._session, "_get_azure_test_case_valid_states", lambda: None
+    )
+    batch._open_session()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        fetches = [
+            executor.submit(test_plan.witc.get_work_items, [test_plan.plan_id])
+            for test_plan in batch.test_plans
+        ]
+        assert [fetch.result() for fetch in fetches] == [["1"], ["2"]]
+
+
+def test_batch_rejects_shared_watermark_file():
+    with raises(ValueError):
+        ADOTestPlanBatch(
+            ["1", "2"], organization_url=org_url, pat=pat, watermark_file=".sync"
+        )
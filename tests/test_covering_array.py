@@ -0,0 +1,43 @@
+from itertools import combinations, product
+from math import prod
+
+from pytest import mark
+
+from adotestplan_to_pytestbdd.covering_array import covering_array
+
+
+def uncovered(rows, sizes, strength):
+    """every combination of values of strength parameters that no row has"""
+    missing = []
+    for parameters in combinations(range(len(sizes)), min(strength, len(sizes))):
+        covered = {tuple(row[parameter] for parameter in parameters) for row in rows}
+        for values in product(*(range(sizes[parameter]) for parameter in parameters)):
+            if values not in covered:
+                missing.append((parameters, values))
+    return missing
+
+
+@mark.parametrize("strength", [1, 2, 3])
+@mark.parametrize(
+    "sizes", [[2, 2, 2], [3, 3, 3, 3], [4, 3, 2, 5], [1, 5, 2], [5, 1, 4, 6, 2, 3]]
+)
+def test_covering_array_covers_every_combination(sizes, strength):
+    rows = covering_array(sizes, strength)
+    assert not uncovered(rows, sizes, strength)
+    assert all(0 <= value < size for row in rows for value, size in zip(row, sizes))
+    assert len(rows) <= prod(sizes)
+
+
+def test_covering_array_is_smaller():
+    sizes = [10] * 5
+    assert len(covering_array(sizes, 2)) < 200
+    assert len(covering_array([2] * 20, 3)) < 50
+
+
+def test_covering_array_is_deterministic():
+    assert covering_array([4, 3, 2, 5, 3], 2) == covering_array([4, 3, 2, 5, 3], 2)
+
+
+def test_covering_array_edge_cases():
+    assert covering_array([3, 0, 2], 2) == []
+    assert covering_array([2, 3], 2) == list(product(range(2), range(3)))
@@ -0,0 +1,123 @@
+import logging
+from itertools import combinations, product
+
+from pytest import raises
+
+from adotestplan_to_pytestbdd import Feature, Scenario, Step
+from adotestplan_to_pytestbdd.ado_test_plan import SharedParameters
+from adotestplan_to_pytestbdd.exceptions import ExamplesTooLargeError
+from adotestplan_to_pytestbdd.feature_renderer import FeatureRenderer
+
+
+def outline(**parameters):
+    return Feature(
+        id=1,
+        name="Suite",
+        scenarios=[
+            Scenario(
+                id=10,
+                name="Outline",
+                is_outline=True,
+                non_shared_parameters=parameters,
+                steps=[Step(text=f"Given <{name}>") for name in parameters],
+            )
+        ],
+    )
+
+
+def example_rows(contents):
+    """each Examples row after the header, with its cells stripped"""
+    rows = [line for line in contents.splitlines() if line.startswith("\t\t\t|")]
+    return [[cell.strip() for cell in row.split("|")[1:-1]] for row in rows[1:]]
+
+
+def test_render_product():
+    renderer = FeatureRenderer(5, [], {})
+    contents = renderer.render(outline(One=["1", "2"], Two=["a", "b", "c"]))
+    assert len(example_rows(contents)) == 6
+
+
+def test_render_zip():
+    renderer = FeatureRenderer(5, [], {}, examples_mode="zip")
+    contents = renderer.render(outline(One=["1", "2"], Two=["a", "b", "c"]))
+    assert example_rows(contents) == [["1", "a"], ["2", "b"], ["", "c"]]
+
+
+def test_render_zip_keeps_sparse_rows_aligned():
+    # the second data row has no value for One
+    feature = outline(One=["1", None, "3"], Two=["a", "b", "c"])
+    zipped = FeatureRenderer(5, [], {}, examples_mode="zip").render(feature)
+    assert example_rows(zipped) == [["1", "a"], ["", "b"], ["3", "c"]]
+    product = FeatureRenderer(5, [], {}).render(feature)
+    assert [row[0] for row in example_rows(product)] == ["1"] * 3 + ["3"] * 3
+
+
+def test_render_iter_matches_render():
+    renderer = FeatureRenderer(5, [], {})
+    feature = outline(One=[str(i) for i in range(50)], Two=[str(i) for i in range(50)])
+    chunks = list(renderer.iter_render(feature))
+    assert "".join(chunks) == renderer.render(feature)
+    # the 2500 rows aren't all rendered into one chunk
+    assert max(len(chunk) for chunk in chunks) < len(renderer.render(feature)) / 2
+
+
+def test_render_max_example_rows_warns(caplog):
+    renderer = FeatureRenderer(5, [], {}, max_example_rows=4)
+    with caplog.at_level(logging.WARNING):
+        contents = renderer.render(outline(One=["1", "2"], Two=["a", "b", "c"]))
+    assert example_rows(contents) == [["1", "a"], ["1", "b"], ["1", "c"], ["2", "a"]]
+    assert "has 6 Examples rows" in caplog.text
+
+
+def test_render_max_example_rows_errors():
+    renderer = FeatureRenderer(
+        5, [], {}, max_example_rows=4, example_rows_overflow="error"
+    )
+    with raises(ExamplesTooLargeError):
+        renderer.render(outline(One=["1", "2"], Two=["a", "b", "c"]))
+
+
+def test_render_pairwise():
+    renderer = FeatureRenderer(5, [], {}, examples_mode="pairwise")
+    values = ["1", "2", "3"]
+    contents = renderer.render(
+        outline(One=values, Two=values, Three=values, Four=values)
+    )
+    rows = example_rows(contents)
+    assert len(rows) < 3**4
+    for first, second in combinations(range(4), 2):
+        pairs = {(row[first], row[second]) for row in rows}
+        assert pairs == set(product(values, values))
+
+
+def test_render_examples_mode_tag():
+    renderer = FeatureRenderer(5, [], {})
+    feature = outline(One=["1", "2"], Two=["a", "b"], Three=["x", "y"])
+    assert len(example_rows(renderer.render(feature))) == 8
+    feature.scenarios[0].tags = ["examples_pairwise"]
+    assert len(example_rows(renderer.render(feature))) == 4
+    feature.scenarios[0].tags = ["examples_3way"]
+    assert len(example_rows(renderer.render(feature))) == 8
+    feature.scenarios[0].tags = ["examples_zip"]
+    assert len(example_rows(renderer.render(feature))) == 2
+
+
+def test_render_merges_only_referenced_shared_parameters():
+    shared_parameters = {
+        900: SharedParameters(revision=3, parameters={"One": ["1", "2"]}),
+        901: SharedParameters(revision=4, parameters={"One": ["x"], "Two": ["a"]}),
+    }
+    renderer = FeatureRenderer(5, [], shared_parameters)
+    feature = outline(Two=["b"])
+    scenario = feature.scenarios[0]
+    scenario.steps = [Step(text="Given <One> and <Two>")]
+    scenario.shared_parameter_ids = [901, 900]
+    contents = renderer.render(feature)
+    # later sets win, and non-shared parameters win over every set
+    assert example_rows(contents) == [["1", "b"], ["2", "b"]]
+    assert "# Shared Parameters 901: Revision 4" in contents
+
+    scenario.shared_parameter_ids = [900]
+    contents = renderer.render(feature)
+    assert "Shared Parameters 901" not in contents
+    assert list(renderer._merged_shared_parameters) == [(901, 900), (900,)]
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from azure.devops.exceptions import AzureDevOpsClientRequestError
+from pytest import raises
+
+from adotestplan_to_pytestbdd.request_scheduler import RequestScheduler
+
+
+class ThrottlingServiceClient:
+    """stands in for the msrest ServiceClient inside an azure-devops client"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def send(self):
+        return self.responses.pop(0)
+
+
+class ThrottledClient:
+    def __init__(self, responses):
+        self._client = ThrottlingServiceClient(responses)
+
+    def get_work_items(self):
+        response = self._client.send()
+        if response.status_code != 200:
+            raise AzureDevOpsClientRequestError(f"{response.status_code}")
+        return "work items"
+
+
+def response(status_code, **headers):
+    return SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def test_throttled_call_is_retried():
+    scheduler = RequestScheduler(max_concurrency=4)
+    client = scheduler.wrap(
+        ThrottledClient([response(429, **{"Retry-After": "0"}), response(200)]),
+        "witc",
+    )
+    assert client.get_work_items() == "work items"
+    assert scheduler.window == 2
+    assert len(scheduler.latencies["witc.get_work_items"]) == 1
+
+
+def test_other_errors_are_not_retried():
+    scheduler = RequestScheduler()
+    client = scheduler.wrap(ThrottledClient([response(404), response(200)]), "witc")
+    with raises(AzureDevOpsClientRequestError):
+        client.get_work_items()
+
+
+def test_window_shrinks_when_nearly_throttled():
+    scheduler = RequestScheduler(max_concurrency=8)
+    client = scheduler.wrap(
+        ThrottledClient(
+            [
+                response(
+                    200, **{"X-RateLimit-Remaining": "5", "X-RateLimit-Limit": "100"}
+                )
+            ]
+        ),
+        "witc",
+    )
+    client.get_work_items()
+    assert scheduler.window == 4
+
+
+def test_window_grows_from_initial_concurrency():
+    scheduler = RequestScheduler(max_concurrency=4, initial_concurrency=2)
+    client = scheduler.wrap(ThrottledClient([response(200)] * 20), "witc")
+    assert scheduler.window == 2
+    for _ in range(20):
+        client.get_work_items()
+    assert scheduler.window == 4
@@ -0,0 +1,24 @@
+import pytest
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+from adotestplan_to_pytestbdd.exceptions import SnapshotMissError
+from adotestplan_to_pytestbdd.snapshot import Snapshot
+
+
+class WorkItemClient:
+    def get_work_items(self, ids, fields=None):
+        return [WorkItem(id=id, rev=1, fields={"System.Title": "A"}) for id in ids]
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = tmp_path / "snapshot.json.gz"
+    recorded = Snapshot()
+    client = recorded.recording(WorkItemClient(), "work_item_tracking")
+    work_items = client.get_work_items([1, 2], fields=["System.Title"])
+    recorded.save(path)
+
+    replayed = Snapshot.load(path).replaying("work_item_tracking")
+    assert replayed.get_work_items([1, 2], fields=["System.Title"]) == work_items
+    # anything that wasn't asked for while recording can't be answered
+    with pytest.raises(SnapshotMissError):
+        replayed.get_work_items([3], fields=["System.Title"])
@@ -0,0 +1,33 @@
+from bs4 import BeautifulSoup
+from pytest import mark
+
+from adotestplan_to_pytestbdd.step_text import extract_step_text
+
+
+def soup_step_text(markup):
+    p = BeautifulSoup(markup, "html.parser").find("p")
+    return p.get_text() if p is not None else None
+
+
+@mark.parametrize(
+    "markup",
+    [
+        "<DIV><P>Given Hello</P></DIV>",
+        "<DIV><DIV><P>Given Longer &amp;amp; Step 2</P></DIV></DIV>",
+        "<DIV><P>When &quot;a&quot; &lt; &#65;&nbsp;b</P></DIV>",
+        "<DIV><P><BR/></P></DIV>",
+        "<DIV><P> \n</P></DIV>",
+        '<DIV><P>Then <B>bold</B> <span style="a>b">text</span><br></P></DIV>',
+        "<DIV><P/></DIV>",
+        "<DIV>no paragraph</DIV>",
+        # markup the fast path leaves to BeautifulSoup
+        "<DIV><P>Given &foo; and &#150;</P></DIV>",
+        "<DIV><P>outer <P>nested</P></P></DIV>",
+        "<DIV><P>unclosed</DIV>after",
+        "<DIV><P>a <!-- comment --> b</P></DIV>",
+        "<P><pre> keep \n</pre></P>",
+        "",
+    ],
+)
+def test_extract_step_text_matches_beautifulsoup(markup):
+    assert extract_step_text(markup) == soup_step_text(markup)
@@ -0,0 +1,39 @@
+import os
+import time
+
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+from adotestplan_to_pytestbdd import WorkItemCache
+
+
+def test_cache_round_trip(tmp_path):
+    cache = WorkItemCache(tmp_path)
+    work_item = WorkItem(id=1, rev=2, fields={"System.Title": "Scenario A"})
+    cache.put(work_item, {"expand": "All"})
+    assert cache.get(1, 2, {"expand": "All"}) == work_item
+    # a different revision or different fetch options is a miss
+    assert cache.get(1, 3, {"expand": "All"}) is None
+    assert cache.get(1, 2) is None
+
+
+def test_cache_drops_old_revisions(tmp_path):
+    cache = WorkItemCache(tmp_path)
+    cache.put(WorkItem(id=1, rev=1, fields={}))
+    cache.put(WorkItem(id=1, rev=2, fields={}))
+    assert cache.get(1, 1) is None
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_cache_eviction(tmp_path):
+    cache = WorkItemCache(tmp_path, max_age=60)
+    cache.put(WorkItem(id=1, rev=1, fields={}))
+    cache.put(WorkItem(id=2, rev=1, fields={}))
+    stale = time.time() - 120
+    os.utime(next(tmp_path.glob("1-*.json")), (stale, stale))
+    cache.prune()
+    assert cache.get(1, 1) is None
+    assert cache.get(2, 1) is not None
+
+    cache.max_size = 0
+    cache.prune()
+    assert cache.get(2, 1) is None
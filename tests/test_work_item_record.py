@@ -0,0 +1,85 @@
+from azure.devops.v7_0.work_item_tracking.models import WorkItem
+
+from adotestplan_to_pytestbdd.work_item_record import WorkItemRecord
+
+NON_SHARED_PARAMETERS = (
+    '<parameters><param name="One" bind="default"/>'
+    + '<param name="Two" bind="default"/></parameters>'
+)
+NON_SHARED_DATA_SOURCE = (
+    "<NewDataSet><Table1><One>1</One><Two>5</Two></Table1>"
+    + "<Table1><One>2</One><Two>6</Two></Table1></NewDataSet>"
+)
+SHARED_DATA_SOURCE = (
+    '{"parameterMap": [{"localParamName": "x", "sharedParameterName": "x",'
+    + ' "sharedParameterDataSetId": 900}], "sharedParameterDataSetIds": [900]}'
+)
+
+
+def record_for(**fields):
+    fields.setdefault("System.Title", "Scenario A")
+    return WorkItemRecord.from_work_item(WorkItem(id=7, rev=3, fields=fields))
+
+
+def test_record_plain_fields():
+    record = record_for(
+        **{
+            "System.State": "Design",
+            "System.Tags": "smoke; fast",
+            "Microsoft.VSTS.TCM.Steps": '<steps><compref id="2" ref="800"/></steps>',
+        }
+    )
+    assert (record.id, record.rev, record.title) == (7, 3, "Scenario A")
+    assert record.state == "Design"
+    assert record.tags == ("smoke", "fast")
+    assert record.steps.find("compref").get("ref") == "800"
+    assert not record.has_params
+
+
+def test_record_shared_parameters():
+    record = record_for(
+        **{
+            "Microsoft.VSTS.TCM.Parameters": '<parameters><param name="x"/></parameters>',
+            "Microsoft.VSTS.TCM.LocalDataSource": SHARED_DATA_SOURCE,
+        }
+    )
+    assert record.has_params
+    assert record.shared_parameter_ids == (900,)
+    assert record.shared_parameter_map_complete
+    assert record.non_shared_parameters == ()
+
+
+def test_record_non_shared_parameters():
+    record = record_for(
+        **{
+            "Microsoft.VSTS.TCM.Parameters": NON_SHARED_PARAMETERS,
+            "Microsoft.VSTS.TCM.LocalDataSource": NON_SHARED_DATA_SOURCE,
+        }
+    )
+    assert record.has_params
+    assert record.shared_parameter_ids == ()
+    assert record.non_shared_parameters == (("One", ("1", "2")), ("Two", ("5", "6")))
+    assert record.non_shared_parameters_error is None
+
+
+def test_record_non_shared_parameters_with_sparse_rows():
+    data_source = (
+        "<NewDataSet><Table1><Two>5</Two></Table1>"
+        + "<Table1><One>2</One><Two /></Table1></NewDataSet>"
+    )
+    record = record_for(
+        **{
+            "Microsoft.VSTS.TCM.Parameters": NON_SHARED_PARAMETERS,
+            "Microsoft.VSTS.TCM.LocalDataSource": data_source,
+        }
+    )
+    assert record.non_shared_parameters == (("One", (None, "2")), ("Two", ("5", "")))
+
+
+def test_record_non_shared_parameters_without_values():
+    record = record_for(**{"Microsoft.VSTS.TCM.Parameters": NON_SHARED_PARAMETERS})
+    assert record.has_params
+    assert not record.shared_parameter_map_complete
+    assert record.non_shared_parameters_error == (
+        "Non-Shared parameter on 7 has no values"
+    )